@@ -1,6 +1,19 @@
 """Spreadsheet Safety Check - Detect and analyze macros/code in spreadsheets."""
 
-from spreadsheet_safety_check.checker import MacroChecker, MacroFinding
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from spreadsheet_safety_check.checker import MacroChecker, MacroFinding
 
 __version__ = "0.1.0"
 __all__ = ["MacroChecker", "MacroFinding"]
+
+
+def __getattr__(name):
+    # The checker is imported on first use, so the CLI can report bad
+    # arguments without loading it
+    if name in __all__:
+        from spreadsheet_safety_check import checker
+
+        return getattr(checker, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
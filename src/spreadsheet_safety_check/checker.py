@@ -1,33 +1,702 @@
 """Core macro checking functionality."""
 
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+import time
+import zipfile
 from dataclasses import dataclass
-from datetime import datetime
+from functools import lru_cache
+from itertools import count, takewhile
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from xml.etree.ElementTree import iterparse
+
+import anyio
+
+
+def _has_module(name: str) -> bool:
+    """Check whether an optional dependency is installed, without importing it."""
+    return importlib.util.find_spec(name) is not None
+
+
+# The Claude Agent SDK, openpyxl, oletools and odfpy are slow to import, so
+# they are imported where they're first used rather than at module load
+HAS_LXML = _has_module("lxml")
+HAS_OLETOOLS = _has_module("oletools")
+HAS_ODFPY = _has_module("odf")
+HAS_ORJSON = _has_module("orjson")
+
+# OpenDocument table elements and attributes, as named by ElementTree
+_ODF_TABLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+_ODF_TABLE = _ODF_TABLE_NS + "table"
+_ODF_TABLE_ROW = _ODF_TABLE_NS + "table-row"
+_ODF_TABLE_CELLS = (
+    _ODF_TABLE_NS + "table-cell",
+    _ODF_TABLE_NS + "covered-table-cell",  # Hidden by a merged cell
+)
+_ODF_NAME = _ODF_TABLE_NS + "name"
+_ODF_FORMULA = _ODF_TABLE_NS + "formula"
+_ODF_COLUMNS_REPEATED = _ODF_TABLE_NS + "number-columns-repeated"
+_ODF_ROWS_REPEATED = _ODF_TABLE_NS + "number-rows-repeated"
+# Basic/<library>/<module>.xml parts holding OpenOffice Basic source, the
+# script-lb.xml/script-lc.xml library indexes don't contain any code
+_ODF_BASIC_INDEXES = frozenset({"script-lb.xml", "script-lc.xml"})
+# Scripts/<language>/... holds Python, BeanShell and JavaScript macro source,
+# alongside a parcel-descriptor.xml listing them
+_ODF_SCRIPT_DESCRIPTOR = "parcel-descriptor.xml"
+_ODF_MACRO_DIRS = ("Basic/", "Scripts/")
+
+# SpreadsheetML worksheet elements, in both the transitional and strict
+# namespaces, as named by ElementTree
+_XLSX_NAMESPACES = (
+    "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}",
+    "{http://purl.oclc.org/ooxml/spreadsheetml/main}",
+)
+_XLSX_SHEET_DATA = frozenset(ns + "sheetData" for ns in _XLSX_NAMESPACES)
+_XLSX_ROW = frozenset(ns + "row" for ns in _XLSX_NAMESPACES)
+_XLSX_CELL = frozenset(ns + "c" for ns in _XLSX_NAMESPACES)
+_XLSX_FORMULA = frozenset(ns + "f" for ns in _XLSX_NAMESPACES)
+
+# Raw-byte patterns for rewriting SpreadsheetML parts in place, which keeps
+# everything but the edited elements exactly as the original producer wrote it
+_XLSX_CELL_RE = re.compile(rb"<((?:\w+:)?)c\b([^>]*?)(/>|>.*?</\1c>)", re.DOTALL)
+_XLSX_CELL_REF_RE = re.compile(rb'\br="([A-Za-z]+\d+)"')
+# Shared and array formulas anchored on a cell, other cells depend on these
+_XLSX_FORMULA_RANGE_RE = re.compile(rb'<(?:\w+:)?f\b[^>]*\bref="')
+_XLSX_FILLS_RE = re.compile(rb"<((?:\w+:)?)fills\b[^>]*>(.*?)</\1fills>", re.DOTALL)
+_XLSX_FILL_RE = re.compile(rb"<(?:\w+:)?fill\b")
+_XLSX_CELL_XFS_RE = re.compile(
+    rb"<((?:\w+:)?)cellXfs\b[^>]*>(.*?)</\1cellXfs>", re.DOTALL
+)
+_XLSX_XF_RE = re.compile(rb"<(?:\w+:)?xf\b")
+_XLSX_RELATIONSHIP_RE = re.compile(
+    rb'<(?:\w+:)?Relationship\b[^>]*?\bTarget="([^"]*)"[^>]*/>'
+)
+_XLSX_OVERRIDE_RE = re.compile(
+    rb'<(?:\w+:)?Override\b[^>]*?\bPartName="/([^"]*)"[^>]*/>'
+)
+# The VBA project and its signatures, by content type and by the last segment
+# of the relationship type pointing at them
+_XLSX_VBA_CONTENT_TYPES = frozenset(
+    "application/vnd.ms-office." + name
+    for name in (
+        "vbaProject",
+        "vbaProjectSignature",
+        "vbaProjectSignatureAgile",
+        "vbaProjectSignatureV3",
+    )
+)
+_XLSX_VBA_RELATIONSHIPS = frozenset(
+    {
+        "vbaProject",
+        "vbaProjectSignature",
+        "vbaProjectSignatureAgile",
+        "vbaProjectSignatureV3",
+    }
+)
+# Parts and relationships a sanitized copy can carry over as they are. Anything
+# else, such as XLM macro sheets, ActiveX controls, OLE objects, a custom ribbon
+# or external data connections, is left to openpyxl to drop.
+_XLSX_COPYABLE_CONTENT_TYPES = frozenset(
+    {
+        "application/xml",
+        "application/vnd.openxmlformats-package.relationships+xml",
+        "application/vnd.openxmlformats-package.core-properties+xml",
+        "application/vnd.openxmlformats-officedocument.extended-properties+xml",
+        "application/vnd.openxmlformats-officedocument.custom-properties+xml",
+        "application/vnd.openxmlformats-officedocument.customXmlProperties+xml",
+        "application/vnd.openxmlformats-officedocument.theme+xml",
+        "application/vnd.openxmlformats-officedocument.drawing+xml",
+        "application/vnd.openxmlformats-officedocument.drawingml.chart+xml",
+        "application/vnd.openxmlformats-officedocument.vmlDrawing",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.printerSettings",
+        "application/vnd.ms-office.chartstyle+xml",
+        "application/vnd.ms-office.chartcolorstyle+xml",
+        "application/vnd.ms-excel.person+xml",
+        "application/vnd.ms-excel.threadedcomments+xml",
+        "application/vnd.ms-excel.sheet.macroEnabled.main+xml",
+        "application/vnd.ms-excel.template.macroEnabled.main+xml",
+        "application/vnd.ms-excel.addin.macroEnabled.main+xml",
+        "image/bmp",
+        "image/gif",
+        "image/jpeg",
+        "image/png",
+        "image/tiff",
+        "image/x-emf",
+        "image/x-wmf",
+    }
+    | {
+        f"application/vnd.openxmlformats-officedocument.spreadsheetml.{name}+xml"
+        for name in (
+            "sheet.main",
+            "template.main",
+            "worksheet",
+            "chartsheet",
+            "styles",
+            "sharedStrings",
+            "calcChain",
+            "comments",
+            "table",
+            "pivotTable",
+            "pivotCacheDefinition",
+            "pivotCacheRecords",
+            "sheetMetadata",
+        )
+    }
+)
+_XLSX_COPYABLE_RELATIONSHIPS = frozenset(
+    {
+        "officeDocument",
+        "core-properties",
+        "extended-properties",
+        "custom-properties",
+        "thumbnail",
+        "worksheet",
+        "chartsheet",
+        "styles",
+        "sharedStrings",
+        "theme",
+        "calcChain",
+        "drawing",
+        "chart",
+        "chartStyle",
+        "chartColorStyle",
+        "image",
+        "comments",
+        "threadedComment",
+        "person",
+        "vmlDrawing",
+        "table",
+        "pivotTable",
+        "pivotCacheDefinition",
+        "pivotCacheRecords",
+        "printerSettings",
+        "hyperlink",
+        "sheetMetadata",
+        "customXml",
+        "customXmlProps",
+    }
+)
+
+# dataclass(slots=True) needs Python 3.10+, older versions fall back to __dict__
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+# File types that can carry a VBA project
+MACRO_ENABLED_SUFFIXES = frozenset({".xlsm", ".xlsb", ".xls", ".xltm", ".xlam"})
+
+# Where the CLI keeps results between runs
+DEFAULT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "spreadsheet-safety-check"
+)
+
+# Maximum number of Claude requests in flight at once
+ANALYSIS_CONCURRENCY = 8
+
+# Number of formulas sent to Claude in a single batched prompt
+FORMULA_BATCH_SIZE = 16
+
+# Part of every analysis cache key, bump it when the prompts or the format of
+# Claude's replies change so that older analyses aren't reused
+_ANALYSIS_CACHE_VERSION = 2
+
+# Placeholder analyses returned when Claude couldn't be reached, didn't answer
+# or gave no score, these aren't kept in the on-disk cache
+_ANALYSIS_FAILURES = ("Unable to analyze", "Error during analysis")
+
+SYSTEM_PROMPT = "You are a security analyst specializing in spreadsheet macro and formula analysis. Be concise and precise."
+
+SCORE_GUIDE = """A security score from 1-10 where:
+   - 1-3: Definitely malicious (file access, network calls, process execution, obfuscation)
+   - 4-6: Suspicious (external references, dynamic execution, questionable patterns)
+   - 7-9: Potentially risky but may be legitimate (common functions that could be misused)
+   - 10: Safe (simple calculations, harmless formulas)"""
+
+
+# Functions that only calculate on values already in the workbook
+SAFE_FORMULA_FUNCTIONS = frozenset(
+    {
+        "ABS", "AND", "AVERAGE", "AVERAGEIF", "AVERAGEIFS", "CEILING", "CHOOSE",
+        "COLUMN", "COLUMNS", "CONCAT", "CONCATENATE", "COUNT", "COUNTA",
+        "COUNTBLANK", "COUNTIF", "COUNTIFS", "DATE", "DATEDIF", "DAY", "EDATE",
+        "EOMONTH", "EXACT", "EXP", "FALSE", "FIND", "FLOOR", "FV", "HLOOKUP",
+        "HOUR", "IF", "IFERROR", "IFNA", "IFS", "INDEX", "INT", "IRR", "ISBLANK",
+        "ISERROR", "ISNA", "ISNUMBER", "ISTEXT", "LARGE", "LEFT", "LEN", "LN",
+        "LOG", "LOG10", "LOOKUP", "LOWER", "MATCH", "MAX", "MAXIFS", "MEDIAN",
+        "MID", "MIN", "MINIFS", "MINUTE", "MOD", "MONTH", "NETWORKDAYS", "NOT",
+        "NOW", "NPV", "OR", "PI", "PMT", "POWER", "PRODUCT", "PROPER", "PV",
+        "RANK", "RATE", "REPLACE", "REPT", "RIGHT", "ROUND", "ROUNDDOWN",
+        "ROUNDUP", "ROW", "ROWS", "SEARCH", "SECOND", "SMALL", "SQRT", "STDEV",
+        "SUBSTITUTE", "SUBTOTAL", "SUM", "SUMIF", "SUMIFS", "SUMPRODUCT", "TEXT",
+        "TEXTJOIN", "TIME", "TODAY", "TRIM", "TRUE", "UPPER", "VALUE", "VAR",
+        "VLOOKUP", "WEEKDAY", "WORKDAY", "XLOOKUP", "XMATCH", "XOR", "YEAR",
+    }
+)  # fmt: skip
+
+# Excel 4.0 macro calls and DDE links, which run code or load native libraries
+_DANGEROUS_FORMULA_RE = re.compile(
+    r"\b(EXEC|CALL|REGISTER(?:\.ID)?)\s*\(|\b(\w+)\|", re.IGNORECASE
+)
+
+# Text joined together from string literals and CHAR(n) calls with &, used to
+# spell out commands that would otherwise be spotted
+_TEXT_PART = r'"(?:[^"]|"")*"|\bCHAR\s*\(\s*\d+\s*\)'
+_TEXT_CHAIN_RE = re.compile(
+    rf"(?:{_TEXT_PART})(?:\s*&\s*(?:{_TEXT_PART}))*", re.IGNORECASE
+)
+_TEXT_CHAIN_PART_RE = re.compile(
+    r'"((?:[^"]|"")*)"|CHAR\s*\(\s*(\d+)\s*\)', re.IGNORECASE
+)
+_OBFUSCATED_COMMAND_RE = re.compile(
+    r"EXEC|CALL|REGISTER|SHELL|CMD|POWERSHELL|WSCRIPT|URLDOWNLOAD|HTTPS?:",
+    re.IGNORECASE,
+)
+
+_STRING_LITERAL_RE = re.compile(r'"(?:[^"]|"")*"')
+# Splits text into alternating non-literal and literal pieces
+_STRING_LITERAL_SPLIT_RE = re.compile(f"({_STRING_LITERAL_RE.pattern})")
+_SHEET_PREFIX_RE = re.compile(r"(?:'[^']*'|[\w.]+)!")
+_ODS_REFERENCE_RE = re.compile(r"\[[^\]'#|]*\]")
+_FUNCTION_NAME_RE = re.compile(r"([A-Za-z_][\w.]*)\s*\(")
+_IDENTIFIER_RE = re.compile(r"(?<![\w.$])[A-Za-z_][\w.$]*(?![\w.$]*\s*\()")
+# A1 through XFD1048576, anything past the edge of the grid is a defined name
+_CELL_REFERENCE_RE = re.compile(
+    r"\$?(?:[A-Z]{1,2}|[A-E][A-Z]{2}|F[A-W][A-Z]|FX[A-D])\$?([1-9]\d{0,6})|TRUE|FALSE",
+    re.IGNORECASE,
+)
+_MAX_ROW = 1048576
+
+
+def _iterparse(source, events):
+    """Stream-parse XML, using lxml's faster parser when it is installed."""
+    if HAS_LXML:
+        from lxml import etree
+
+        # Spreadsheets are untrusted input, never pull in external entities
+        return etree.iterparse(source, events=events, resolve_entities=False)
+    return iterparse(source, events=events)
+
+
+def _odf_repeat_count(value: Optional[str]) -> int:
+    """Parse a number-columns/rows-repeated attribute, defaulting to 1."""
+    try:
+        return max(1, int(value)) if value else 1
+    except ValueError:
+        return 1
+
+
+def _xml_local_name(name: str) -> str:
+    """Strip the {namespace} from an ElementTree tag or attribute name."""
+    return name.rpartition("}")[2]
+
+
+def _xlsx_part_path(source_dir: str, target: str) -> str:
+    """Resolve a relationship target to the name of a part in the package."""
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(source_dir, target))
+
+
+def _xlsx_relationships(archive: zipfile.ZipFile, part: str) -> Dict[str, Tuple]:
+    """Map relationship ids of a package part to (type, target part)."""
+    source_dir, name = posixpath.split(part)
+    rels_name = posixpath.join(source_dir, "_rels", f"{name}.rels")
+    relationships = {}
+    with archive.open(rels_name) as rels:
+        for _event, elem in _iterparse(rels, ("start",)):
+            if _xml_local_name(elem.tag) == "Relationship":
+                target = _xlsx_part_path(source_dir, elem.get("Target", ""))
+                relationships[elem.get("Id")] = (elem.get("Type", ""), target)
+    return relationships
+
+
+def _xlsx_workbook_parts(archive: zipfile.ZipFile) -> Tuple[str, Dict, Dict]:
+    """Find the workbook part, its relationships and the part of each sheet.
+
+    Returns:
+        Tuple of (workbook part, {rel id: (type, part)}, {sheet name: part})
+    """
+    workbook = next(
+        target
+        for rel_type, target in _xlsx_relationships(archive, "").values()
+        if rel_type.endswith("/officeDocument")
+    )
+    relationships = _xlsx_relationships(archive, workbook)
+
+    sheets = {}
+    with archive.open(workbook) as workbook_xml:
+        for _event, elem in _iterparse(workbook_xml, ("start",)):
+            if _xml_local_name(elem.tag) == "sheet":
+                rel_id = next(
+                    value
+                    for key, value in elem.attrib.items()
+                    if _xml_local_name(key) == "id"
+                )
+                sheets[elem.get("name")] = relationships[rel_id][1]
+
+    return workbook, relationships, sheets
+
+
+def _xlsx_content_types(archive: zipfile.ZipFile) -> Dict[str, Optional[str]]:
+    """Map each part in the package to its content type."""
+    defaults = {}
+    overrides = {}
+    with archive.open("[Content_Types].xml") as content_types:
+        for _event, elem in _iterparse(content_types, ("start",)):
+            tag = _xml_local_name(elem.tag)
+            if tag == "Default":
+                defaults[elem.get("Extension", "").lower()] = elem.get("ContentType")
+            elif tag == "Override":
+                part = elem.get("PartName", "").lstrip("/").lower()
+                overrides[part] = elem.get("ContentType")
+
+    return {
+        # Not splitext, which takes _rels/.rels to have no extension
+        name: overrides.get(name.lower(), defaults.get(name.rpartition(".")[2].lower()))
+        for name in archive.namelist()
+        if name != "[Content_Types].xml" and not name.endswith("/")
+    }
+
+
+def _xlsx_macro_parts(archive: zipfile.ZipFile) -> Optional[Set[str]]:
+    """Find the VBA project parts to leave out of a sanitized copy.
+
+    Parts are recognised by their content type or the relationship pointing at
+    them, whatever they're called. Returns None if the package holds any other
+    part or relationship that isn't known to be safe to copy as is.
+    """
+    content_types = _xlsx_content_types(archive)
+    vba = {
+        name
+        for name, content_type in content_types.items()
+        if content_type in _XLSX_VBA_CONTENT_TYPES
+    }
+
+    for name in content_types:
+        rels_dir, rels_name = posixpath.split(name)
+        if posixpath.basename(rels_dir) != "_rels" or not rels_name.endswith(".rels"):
+            continue
+        source = posixpath.join(posixpath.dirname(rels_dir), rels_name[: -len(".rels")])
+        for rel_type, target in _xlsx_relationships(archive, source).values():
+            kind = rel_type.rpartition("/")[2]
+            if kind in _XLSX_VBA_RELATIONSHIPS:
+                vba.add(target)
+            elif kind not in _XLSX_COPYABLE_RELATIONSHIPS:
+                return None
+
+    # The VBA parts go along with their own relationships
+    dropped = set(vba)
+    for part in vba:
+        part_dir, part_name = posixpath.split(part)
+        dropped.add(posixpath.join(part_dir, "_rels", f"{part_name}.rels"))
+
+    if any(
+        content_type not in _XLSX_COPYABLE_CONTENT_TYPES
+        for name, content_type in content_types.items()
+        if name not in dropped
+    ):
+        return None
+    return dropped
+
+
+def _add_highlight_style(styles: bytes) -> Optional[Tuple[bytes, int]]:
+    """Add a yellow-filled cell format to styles.xml.
+
+    Returns:
+        Tuple of (new styles.xml, index of the format), or None if the
+        stylesheet doesn't have the expected fills and cellXfs lists
+    """
+    fills = _XLSX_FILLS_RE.search(styles)
+    cell_xfs = _XLSX_CELL_XFS_RE.search(styles)
+    if fills is None or cell_xfs is None or fills.start() > cell_xfs.start():
+        return None
+
+    prefix, body = fills.groups()
+    fill_id = len(_XLSX_FILL_RE.findall(body))
+    p = prefix.decode()
+    fill = (
+        f'<{p}fill><{p}patternFill patternType="solid">'
+        f'<{p}fgColor rgb="00FFFF00"/><{p}bgColor rgb="00FFFF00"/>'
+        f"</{p}patternFill></{p}fill>"
+    )
+    new_fills = (
+        f'<{p}fills count="{fill_id + 1}">'.encode() + body + fill.encode()
+    ) + f"</{p}fills>".encode()
+
+    prefix, body = cell_xfs.groups()
+    xf_id = len(_XLSX_XF_RE.findall(body))
+    p = prefix.decode()
+    xf = (
+        f'<{p}xf numFmtId="0" fontId="0" fillId="{fill_id}" borderId="0" '
+        f'xfId="0" applyFill="1"/>'
+    )
+    new_cell_xfs = (
+        f'<{p}cellXfs count="{xf_id + 1}">'.encode() + body + xf.encode()
+    ) + f"</{p}cellXfs>".encode()
+
+    return (
+        styles[: fills.start()]
+        + new_fills
+        + styles[fills.end() : cell_xfs.start()]
+        + new_cell_xfs
+        + styles[cell_xfs.end() :]
+    ), xf_id
+
+
+def _replace_xlsx_cells(
+    sheet: bytes, cells: Dict[str, int], style_id: int
+) -> Optional[bytes]:
+    """Replace cells in a worksheet part with highlighted "CODE REMOVED" text.
+
+    Args:
+        sheet: The worksheet XML
+        cells: Item number of each cell to replace, keyed by reference ("A3")
+        style_id: Index of the highlight cell format
+
+    Returns:
+        The new worksheet XML, or None if a cell couldn't be safely replaced
+    """
+    replaced = set()
+
+    def replace(match):
+        prefix, attrs, body = match.groups()
+        ref = _XLSX_CELL_REF_RE.search(attrs)
+        if ref is None:
+            return match.group(0)
+        ref = ref.group(1).decode().upper()
+        if ref not in cells or _XLSX_FORMULA_RANGE_RE.search(body):
+            return match.group(0)
+
+        replaced.add(ref)
+        p = prefix.decode()
+        return (
+            f'<{p}c r="{ref}" s="{style_id}" t="inlineStr"><{p}is>'
+            f"<{p}t>CODE REMOVED: Item #{cells[ref]}</{p}t></{p}is></{p}c>"
+        ).encode()
+
+    sheet = _XLSX_CELL_RE.sub(replace, sheet)
+    return sheet if len(replaced) == len(cells) else None
+
+
+def _parse_score_response(text: str) -> Tuple[Optional[int], Optional[str]]:
+    """Pull the score and analysis out of a "SCORE: <n>/ANALYSIS: ..." reply.
+
+    Either is None when missing. The analysis runs to the end of the text.
+    """
+    score = None
+    _, found, rest = ("\n" + text).partition("\nSCORE:")
+    if found:
+        digits = "".join(takewhile(str.isdigit, rest.lstrip()))
+        if digits:
+            score = int(digits)
+
+    _, found, rest = text.partition("ANALYSIS:")
+    return score, rest.strip() if found else None
+
+
+def _parse_batch_response(text: str) -> Dict[int, Tuple[int, str]]:
+    """Read the [{"id", "score", "analysis"}, ...] JSON out of a batched reply.
+
+    Returns (score, analysis) keyed by item id, leaving out entries that are
+    missing or malformed.
+    """
+    decoder = json.JSONDecoder()
+    # Skip over any prose or code fence before the array, which may hold
+    # brackets of its own, even empty or otherwise valid JSON arrays
+    start = text.find("[")
+    while start != -1:
+        try:
+            entries, _end = decoder.raw_decode(text, start)
+        except ValueError:
+            entries = None
+        if (
+            isinstance(entries, list)
+            and entries
+            and all(isinstance(e, dict) for e in entries)
+            and any("id" in e for e in entries)
+        ):
+            break
+        start = text.find("[", start + 1)
+    else:
+        return {}
+
+    results = {}
+    for entry in entries:
+        index, score = entry.get("id"), entry.get("score")
+        if type(index) is int and type(score) is int:
+            analysis = str(entry.get("analysis") or "Unable to analyze")
+            results[index] = (max(1, min(10, score)), analysis)
+    return results
+
+
+def _read_cache(
+    path: Path, label: str, validate: Optional[Callable[[Any], bool]] = None
+):
+    """Load a JSON cache entry, or None if it's missing, unreadable or invalid.
+
+    Entries that don't parse or that validate() rejects are deleted, so a good
+    one is written in their place.
+    """
+    if not path.exists():
+        return None
+    try:
+        data = path.read_bytes()
+    except OSError as e:
+        print(f"Ignoring unreadable {label} cache {path}: {e}")
+        return None
+
+    try:
+        if HAS_ORJSON:
+            import orjson
+
+            entry = orjson.loads(data)
+        else:
+            entry = json.loads(data)
+    except ValueError as e:
+        print(f"Discarding corrupt {label} cache {path}: {e}")
+        entry = None
+    else:
+        if validate is None or validate(entry):
+            return entry
+        print(f"Discarding malformed {label} cache {path}")
+
+    with contextlib.suppress(OSError):
+        path.unlink()
+    return None
+
+
+def _is_vba_cache_entry(entry) -> bool:
+    """Check a cached VBA extraction is a list of [location, code] pairs."""
+    return isinstance(entry, list) and all(
+        isinstance(pair, list)
+        and len(pair) == 2
+        and all(isinstance(value, str) for value in pair)
+        for pair in entry
+    )
 
-from claude_agent_sdk import AssistantMessage, ClaudeAgentOptions, TextBlock, query
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
-from openpyxl.utils import get_column_letter
 
-try:
-    from oletools.olevba import VBA_Parser
+def _write_cache(path: Path, data, label: str):
+    """Store a JSON cache entry, warning rather than failing on errors."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so other runs never see a partial file
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        if HAS_ORJSON:
+            import orjson
+
+            tmp_path.write_bytes(orjson.dumps(data))
+        else:
+            tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: could not write {label} cache {path}: {e}")
+
+
+def _is_analysis_cache_entry(entry) -> bool:
+    """Check a cached analysis is a [score 1-10, analysis] pair."""
+    return (
+        isinstance(entry, list)
+        and len(entry) == 2
+        and type(entry[0]) is int
+        and 1 <= entry[0] <= 10
+        and isinstance(entry[1], str)
+    )
 
-    HAS_OLETOOLS = True
-except ImportError:
-    HAS_OLETOOLS = False
 
-try:
-    from odf.opendocument import load as load_odf
-    from odf.table import Table, TableCell, TableRow
-    from odf.text import P
+def _decode_char_concat(formula: str) -> str:
+    """Return the text spelled out by CHAR(n) calls in a formula.
+
+    Each run of string literals and CHAR calls joined with & is decoded as a
+    whole, so "EX"&CHAR(69)&"C" gives EXEC. Runs without a CHAR call are
+    left out.
+    """
+    decoded = []
+    for chain in _TEXT_CHAIN_RE.finditer(formula):
+        text = []
+        has_char = False
+        for literal, code in _TEXT_CHAIN_PART_RE.findall(chain.group(0)):
+            if code:
+                has_char = True
+                if 1 <= int(code) <= 255:
+                    text.append(chr(int(code)))
+            else:
+                text.append(literal.replace('""', '"'))
+        if has_char:
+            decoded.append("".join(text))
+
+    return " ".join(decoded)
+
+
+@lru_cache(maxsize=4096)
+def _local_prescreen(formula: str) -> Optional[Tuple[int, str]]:
+    """Score a formula locally when the verdict does not need Claude.
+
+    Returns:
+        Tuple of (score: int 1-10, analysis: str), or None if the formula
+        needs a full analysis
+    """
+    if formula.startswith("of:"):
+        # OpenDocument formulas wrap cell references in brackets: [.A1:.B2]
+        formula = _ODS_REFERENCE_RE.sub("A1", formula[3:])
+
+    bare = _STRING_LITERAL_RE.sub('""', formula)
+
+    match = _DANGEROUS_FORMULA_RE.search(bare)
+    if match:
+        if match.group(1):
+            reason = f"calls the Excel 4.0 macro function {match.group(1).upper()}"
+        else:
+            reason = f"is a DDE link to the '{match.group(2)}' application"
+        return 1, f"Formula {reason}, which can run arbitrary code. (Scored locally)"
+
+    # Most formulas don't call CHAR at all, skip the decode regexes for them
+    decoded = _decode_char_concat(formula) if "CHAR" in formula.upper() else ""
+    match = _OBFUSCATED_COMMAND_RE.search(decoded)
+    if match:
+        return (
+            2,
+            f"Formula spells out '{decoded}' with CHAR() codes, hiding "
+            f"'{match.group(0).upper()}' from simple inspection. (Scored locally)",
+        )
 
-    HAS_ODFPY = True
-except ImportError:
-    HAS_ODFPY = False
+    if any(char in bare for char in "[|#"):
+        # External workbook links, structured references and error literals
+        return None
+
+    for name in _FUNCTION_NAME_RE.findall(bare):
+        name = name.upper()
+        for prefix in ("_XLFN.", "_XLWS."):
+            if name.startswith(prefix):
+                name = name[len(prefix) :]
+        if name not in SAFE_FORMULA_FUNCTIONS:
+            return None
+
+    # Anything else named in the formula must be a plain cell reference, since
+    # defined names can hide macro formulas
+    bare = _SHEET_PREFIX_RE.sub("", bare)
+    if not bare.isascii():
+        # Names can start with letters the patterns here don't cover
+        return None
+    for name in _IDENTIFIER_RE.findall(bare):
+        match = _CELL_REFERENCE_RE.fullmatch(name)
+        if not match or int(match.group(1) or 1) > _MAX_ROW:
+            return None
+
+    return (
+        10,
+        "Formula only uses common calculation functions and cell references. (Scored locally)",
+    )
 
 
-@dataclass
+@dataclass(frozen=True, **_DATACLASS_SLOTS)
 class MacroFinding:
     """Represents a discovered macro or suspicious code."""
 
@@ -44,14 +713,22 @@ class MacroFinding:
 class MacroChecker:
     """Main class for checking macros in spreadsheet files."""
 
-    def __init__(self, input_file: str, remove_threshold: int = 5):
+    def __init__(
+        self,
+        input_file: str,
+        remove_threshold: int = 5,
+        cache_dir: Optional[Path] = None,
+    ):
         self.input_file = Path(input_file)
         self.remove_threshold = remove_threshold
+        # Persistent cache location, None disables caching between runs
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
         self.findings: List[MacroFinding] = []
         self.workbook = None
-        self.ods_doc = None
         self.item_counter = 0
         self.file_type = None  # 'excel' or 'ods'
+        # Claude results keyed by the exact code analyzed
+        self._analysis_cache: Dict[str, Tuple[int, str]] = {}
 
     def load_spreadsheet(self):
         """Load the spreadsheet (Excel or OpenOffice)."""
@@ -59,16 +736,25 @@ class MacroChecker:
             suffix = self.input_file.suffix.lower()
 
             if suffix in [".xlsx", ".xlsm"]:
+                from openpyxl import load_workbook
+
                 self.file_type = "excel"
-                self.workbook = load_workbook(self.input_file, data_only=False)
+                # Scanning only reads cells, the sanitizer loads its own
+                # editable copy of the workbook. External link caches aren't
+                # scanned, so don't spend time loading them.
+                self.workbook = load_workbook(
+                    self.input_file,
+                    read_only=True,
+                    data_only=False,
+                    keep_links=False,
+                )
                 print(f"Loaded Excel spreadsheet: {self.input_file}")
                 return True
             elif suffix == ".ods":
-                if not HAS_ODFPY:
-                    print("Error: odfpy not installed. Install with: pip install odfpy")
-                    return False
                 self.file_type = "ods"
-                self.ods_doc = load_odf(str(self.input_file))
+                # Formulas are streamed from content.xml, make sure it's there
+                with zipfile.ZipFile(self.input_file) as archive:
+                    archive.getinfo("content.xml")
                 print(f"Loaded OpenOffice spreadsheet: {self.input_file}")
                 return True
             else:
@@ -79,16 +765,66 @@ class MacroChecker:
             print(f"Error loading spreadsheet: {e}")
             return False
 
+    def _may_contain_vba(self) -> bool:
+        """Check whether the file type can carry VBA macros at all."""
+        suffix = self.input_file.suffix.lower()
+        if suffix in MACRO_ENABLED_SUFFIXES:
+            return True
+        if suffix != ".xlsx":
+            return False
+
+        # A macro-enabled workbook renamed to .xlsx still carries its project,
+        # found by content type or relationship whatever the part is called
+        try:
+            with zipfile.ZipFile(self.input_file) as archive:
+                macro_parts = _xlsx_macro_parts(archive)
+        except (zipfile.BadZipFile, KeyError, SyntaxError):
+            # Possibly a legacy .xls file or a damaged package, let oletools
+            # take a look
+            return True
+        # None means there are parts that could carry macros some other way
+        return macro_parts is None or bool(macro_parts)
+
+    def _vba_cache_path(self) -> Optional[Path]:
+        """Path of the cached VBA extraction for this file's contents."""
+        if self.cache_dir is None:
+            return None
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.input_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+        return self.cache_dir / "vba" / f"{digest.hexdigest()}.json"
+
     def detect_vba_macros(self) -> List[Tuple[str, str]]:
         """Detect VBA macros in the spreadsheet."""
         macros = []
 
+        if self.file_type == "ods":
+            return self._detect_ods_macros()
+
+        if not self._may_contain_vba():
+            return macros
+
+        cache_path = self._vba_cache_path()
+        cached = (
+            None
+            if cache_path is None
+            else _read_cache(cache_path, "VBA", _is_vba_cache_entry)
+        )
+        if cached is not None:
+            print("Using cached VBA macro extraction")
+            return [(location, code) for location, code in cached]
+
         if not HAS_OLETOOLS:
             print("Warning: oletools not installed, VBA macro detection disabled")
             print("Install with: pip install oletools")
             return macros
 
         try:
+            from oletools.olevba import VBA_Parser
+
             vba_parser = VBA_Parser(str(self.input_file))
 
             if vba_parser.detect_vba_macros():
@@ -107,11 +843,70 @@ class MacroChecker:
             vba_parser.close()
         except Exception as e:
             print(f"Error detecting VBA macros: {e}")
+            return macros
+
+        if cache_path is not None:
+            _write_cache(cache_path, macros, "VBA")
 
         return macros
 
-    def detect_formula_cells(self) -> List[Tuple[str, str, str, int]]:
-        """Detect cells with formulas (Excel and ODS)."""
+    def _detect_ods_macros(self) -> List[Tuple[str, str]]:
+        """Detect OpenOffice Basic and script macros in an ODS file.
+
+        Each Basic module is stream-parsed and only its source text is kept,
+        Python, BeanShell and JavaScript macros are stored as plain source.
+        """
+        macros = []
+
+        try:
+            with zipfile.ZipFile(self.input_file) as archive:
+                for name in archive.namelist():
+                    directory, module = posixpath.split(name)
+                    top, _, library = directory.partition("/")
+                    if top == "Scripts":
+                        if library and module and module != _ODF_SCRIPT_DESCRIPTOR:
+                            code = archive.read(name).decode("utf-8", "replace")
+                            if code.strip():
+                                macros.append((f"Script: {library}/{module}", code))
+                        continue
+                    if (
+                        top != "Basic"
+                        or not library
+                        or not module.endswith(".xml")
+                        or module in _ODF_BASIC_INDEXES
+                    ):
+                        continue
+
+                    with archive.open(name) as part:
+                        for _event, elem in _iterparse(part, ("end",)):
+                            if _xml_local_name(elem.tag) != "module":
+                                elem.clear()
+                                continue
+                            module_name = next(
+                                (
+                                    value
+                                    for key, value in elem.attrib.items()
+                                    if _xml_local_name(key) == "name"
+                                ),
+                                module[: -len(".xml")],
+                            )
+                            if elem.text and elem.text.strip():
+                                location = f"Basic Module: {library}/{module_name}"
+                                macros.append((location, elem.text))
+                            elem.clear()
+        except (zipfile.BadZipFile, SyntaxError) as e:
+            # ElementTree.ParseError and lxml's XMLSyntaxError are SyntaxErrors
+            print(f"Error detecting OpenOffice macros: {e}")
+
+        if macros:
+            print("OpenOffice macros detected!")
+        return macros
+
+    def detect_formula_cells(self) -> Optional[List[Tuple[str, str, str, int]]]:
+        """Detect cells with formulas (Excel and ODS).
+
+        Returns None if the spreadsheet turned out to be unreadable.
+        """
         formula_cells = []
 
         if self.file_type == "excel":
@@ -121,72 +916,237 @@ class MacroChecker:
 
         return formula_cells
 
-    def _detect_excel_formulas(self) -> List[Tuple[str, str, str, int]]:
+    def _detect_excel_formulas(self) -> Optional[List[Tuple[str, str, str, int]]]:
         """Detect formulas in Excel spreadsheets."""
+        try:
+            return self._stream_excel_formulas()
+        except (KeyError, StopIteration, SyntaxError, zipfile.BadZipFile) as e:
+            # ParseError from either XML parser is a SyntaxError
+            print(f"Falling back to openpyxl to read formulas: {e}")
+
+        from openpyxl.utils import get_column_letter
+
         formula_cells = []
 
-        for sheet_name in self.workbook.sheetnames:
-            sheet = self.workbook[sheet_name]
+        try:
+            for sheet in self.workbook.worksheets:
+                sheet_name = sheet.title
+                # Don't trust the stored sheet size, cells outside it would be
+                # skipped
+                sheet.reset_dimensions()
+
+                # Plain values skip building a cell object for every value,
+                # rows and columns are numbered from A1
+                for row_num, values in enumerate(sheet.iter_rows(values_only=True), 1):
+                    for col_num, value in enumerate(values, 1):
+                        if isinstance(value, str) and value.startswith("="):
+                            col_letter = get_column_letter(col_num)
+                            location = f"{sheet_name}!{col_letter}{row_num}"
+                            formula_cells.append(
+                                (location, value, sheet_name, col_num, row_num)
+                            )
+        except Exception as e:
+            # Read-only workbooks only parse each sheet here, so a damaged
+            # sheet surfaces now rather than in load_spreadsheet
+            print(f"Error reading spreadsheet: {e}")
+            return None
+
+        return formula_cells
 
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if (
-                        cell.value
-                        and isinstance(cell.value, str)
-                        and cell.value.startswith("=")
-                    ):
-                        formula = cell.value
-                        location = f"{sheet_name}!{cell.coordinate}"
-                        formula_cells.append(
-                            (location, formula, sheet_name, cell.column, cell.row)
+    def _stream_excel_formulas(self) -> List[Tuple[str, str, str, int]]:
+        """Detect formulas by stream-parsing the worksheet XML in the package.
+
+        Unlike openpyxl no cell objects are built, and each row is discarded
+        once read. Shared formulas are translated from their anchor cell, as
+        openpyxl does, and array formulas are reported as plain formulas.
+        """
+        from openpyxl.formula.translate import Translator
+        from openpyxl.utils import get_column_letter
+        from openpyxl.utils.cell import coordinate_to_tuple
+
+        formula_cells = []
+
+        with zipfile.ZipFile(self.input_file) as archive:
+            _workbook, _relationships, sheets = _xlsx_workbook_parts(archive)
+            names = set(archive.namelist())
+
+            for sheet_name, part in sheets.items():
+                if part not in names:
+                    # External or missing sheet, nothing to scan
+                    continue
+
+                # Shared formula text and anchor cell, keyed by si
+                shared = {}
+                sheet_data = None
+                row_num = 0
+                prev_col = 0
+                prev_ref = None
+
+                with archive.open(part) as sheet_xml:
+                    for event, elem in _iterparse(sheet_xml, ("start", "end")):
+                        tag = elem.tag
+                        if event == "start":
+                            if tag in _XLSX_SHEET_DATA:
+                                sheet_data = elem
+                            elif tag in _XLSX_ROW:
+                                row_attr = elem.get("r")
+                                row_num = int(row_attr) if row_attr else row_num + 1
+                                prev_col = 0
+                                prev_ref = None
+                            continue
+
+                        if tag in _XLSX_ROW:
+                            if sheet_data is not None:
+                                # Finished with this row, drop it from the tree
+                                sheet_data.remove(elem)
+                            continue
+                        if tag not in _XLSX_CELL:
+                            continue
+
+                        # Cells normally carry their reference, work it out
+                        # from the previous cell when they don't
+                        ref = elem.get("r")
+                        if ref:
+                            prev_ref = ref
+                        else:
+                            if prev_ref:
+                                prev_col = coordinate_to_tuple(prev_ref)[1]
+                                prev_ref = None
+                            prev_col += 1
+
+                        for formula in elem:
+                            if formula.tag in _XLSX_FORMULA:
+                                break
+                        else:
+                            continue
+
+                        row, col = (
+                            coordinate_to_tuple(ref) if ref else (row_num, prev_col)
                         )
+                        text = formula.text
+                        if formula.get("t") == "shared":
+                            si = formula.get("si")
+                            if text:
+                                shared[si] = (text, (row, col))
+                            elif si in shared:
+                                text, (origin_row, origin_col) = shared[si]
+                                origin = f"{get_column_letter(origin_col)}{origin_row}"
+                                target = f"{get_column_letter(col)}{row}"
+                                text = Translator(
+                                    f"={text}", origin=origin
+                                ).translate_formula(target)[1:]
+
+                        if text:
+                            location = f"{sheet_name}!{get_column_letter(col)}{row}"
+                            formula_cells.append(
+                                (location, f"={text}", sheet_name, col, row)
+                            )
 
         return formula_cells
 
-    def _detect_ods_formulas(self) -> List[Tuple[str, str, str, int]]:
-        """Detect formulas in OpenOffice spreadsheets."""
+    def _detect_ods_formulas(self) -> Optional[List[Tuple[str, str, str, int]]]:
+        """Detect formulas in OpenOffice spreadsheets.
+
+        content.xml is parsed as a stream and each row is discarded once read,
+        so memory use doesn't grow with the size of the sheet.
+        """
+        from openpyxl.utils import get_column_letter
+
         formula_cells = []
+        parents = []
+        sheet_name = "Sheet"
+        row_num = 0
+        next_row = 1
+        next_col = 1
 
-        tables = self.ods_doc.spreadsheet.getElementsByType(Table)
-
-        for table in tables:
-            sheet_name = table.getAttribute("name") or "Sheet"
-            rows = table.getElementsByType(TableRow)
-
-            row_num = 0
-            for row in rows:
-                row_num += 1
-                cells = row.getElementsByType(TableCell)
-
-                col_num = 0
-                for cell in cells:
-                    col_num += 1
-
-                    # Handle repeated columns
-                    repeat = cell.getAttribute("numbercolumnsrepeated")
-                    if repeat:
-                        try:
-                            repeat_count = int(repeat)
-                            # Skip large repeated empty columns
-                            if repeat_count > 100:
-                                col_num += repeat_count - 1
-                                continue
-                        except (ValueError, TypeError):
-                            pass
-
-                    # Get formula
-                    formula = cell.getAttribute("formula")
-
-                    if formula:
-                        # Convert column number to letter
-                        col_letter = get_column_letter(col_num)
-                        location = f"{sheet_name}!{col_letter}{row_num}"
-                        formula_cells.append(
-                            (location, formula, sheet_name, col_num, row_num)
-                        )
+        try:
+            with zipfile.ZipFile(self.input_file) as archive, archive.open(
+                "content.xml"
+            ) as content:
+                for event, elem in _iterparse(content, events=("start", "end")):
+                    if event == "start":
+                        if elem.tag == _ODF_TABLE:
+                            sheet_name = elem.get(_ODF_NAME) or "Sheet"
+                            next_row = 1
+                        elif elem.tag == _ODF_TABLE_ROW:
+                            row_num = next_row
+                            next_col = 1
+                        parents.append(elem)
+                        continue
+
+                    parents.pop()
+
+                    if elem.tag in _ODF_TABLE_CELLS:
+                        # Repeated cells share one element, which stands for
+                        # several columns
+                        col_num = next_col
+                        next_col += _odf_repeat_count(elem.get(_ODF_COLUMNS_REPEATED))
+
+                        # Get formula
+                        formula = elem.get(_ODF_FORMULA)
+
+                        if formula:
+                            # Convert column number to letter
+                            col_letter = get_column_letter(col_num)
+                            location = f"{sheet_name}!{col_letter}{row_num}"
+                            formula_cells.append(
+                                (location, formula, sheet_name, col_num, row_num)
+                            )
+
+                    elif elem.tag == _ODF_TABLE_ROW:
+                        next_row += _odf_repeat_count(elem.get(_ODF_ROWS_REPEATED))
+                        if parents:
+                            # Finished with this row, drop it from the tree
+                            parents[-1].remove(elem)
+        except (zipfile.BadZipFile, KeyError, SyntaxError) as e:
+            # ParseError from either XML parser is a SyntaxError
+            print(f"Error reading spreadsheet: {e}")
+            return None
 
         return formula_cells
 
+    @staticmethod
+    def _formula_dedup_key(formula: str) -> str:
+        """Normalize a formula so copies within a scan share one analysis.
+
+        Function names and references are case-insensitive, string literals
+        are kept as they are. Only used within a scan, cached analyses are
+        keyed by the exact code.
+        """
+        pieces = _STRING_LITERAL_SPLIT_RE.split(formula.strip())
+        return "".join(
+            piece if i % 2 else piece.upper() for i, piece in enumerate(pieces)
+        )
+
+    def _cached_analysis(self, code: str) -> Optional[Tuple[int, str]]:
+        """Look up an earlier Claude result for code, in memory then on disk."""
+        if code in self._analysis_cache:
+            return self._analysis_cache[code]
+        if self.cache_dir is None:
+            return None
+
+        cached = _read_cache(
+            self._analysis_cache_path(code), "analysis", _is_analysis_cache_entry
+        )
+        if cached is None:
+            return None
+        score, analysis = cached
+        self._analysis_cache[code] = (score, analysis)
+        return score, analysis
+
+    def _store_analysis(self, code: str, result: Tuple[int, str]):
+        """Remember a Claude result for code, on disk unless it's an error."""
+        self._analysis_cache[code] = result
+        if self.cache_dir is None or result[1].startswith(_ANALYSIS_FAILURES):
+            return
+        _write_cache(self._analysis_cache_path(code), result, "analysis")
+
+    def _analysis_cache_path(self, code: str) -> Path:
+        """Path of the cached Claude result for exactly this code."""
+        key = f"{_ANALYSIS_CACHE_VERSION}\0{code}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / "analysis" / f"{digest}.json"
+
     async def analyze_code_with_claude(
         self, code: str, location: str
     ) -> Tuple[int, str]:
@@ -205,11 +1165,7 @@ Code:
 ```
 
 Provide:
-1. A security score from 1-10 where:
-   - 1-3: Definitely malicious (file access, network calls, process execution, obfuscation)
-   - 4-6: Suspicious (external references, dynamic execution, questionable patterns)
-   - 7-9: Potentially risky but may be legitimate (common functions that could be misused)
-   - 10: Safe (simple calculations, harmless formulas)
+1. {SCORE_GUIDE}
 
 2. A brief analysis explaining the score (2-3 sentences)
 
@@ -218,12 +1174,16 @@ SCORE: <number>
 ANALYSIS: <your analysis here>
 """
 
-        options = ClaudeAgentOptions(
-            max_turns=1,
-            system_prompt="You are a security analyst specializing in spreadsheet macro and formula analysis. Be concise and precise.",
+        from claude_agent_sdk import (
+            AssistantMessage,
+            ClaudeAgentOptions,
+            TextBlock,
+            query,
         )
 
-        score = 5  # default
+        options = ClaudeAgentOptions(max_turns=1, system_prompt=SYSTEM_PROMPT)
+
+        score = None
         analysis = "Unable to analyze"
 
         try:
@@ -231,87 +1191,254 @@ ANALYSIS: <your analysis here>
                 if isinstance(message, AssistantMessage):
                     for block in message.content:
                         if isinstance(block, TextBlock):
-                            text = block.text
-
-                            # Parse score and analysis
-                            lines = text.strip().split("\n")
-                            for line in lines:
-                                if line.startswith("SCORE:"):
-                                    try:
-                                        score = int(line.replace("SCORE:", "").strip())
-                                        score = max(1, min(10, score))  # Clamp to 1-10
-                                    except ValueError:
-                                        pass
-                                elif line.startswith("ANALYSIS:"):
-                                    analysis = line.replace("ANALYSIS:", "").strip()
-
-                            # If analysis wasn't on same line, get remaining text
-                            if analysis == "Unable to analyze" and "ANALYSIS:" in text:
-                                analysis = text.split("ANALYSIS:")[1].strip()
+                            block_score, block_analysis = _parse_score_response(
+                                block.text
+                            )
+                            if block_score is not None:
+                                score = max(1, min(10, block_score))
+                            if block_analysis is not None:
+                                analysis = block_analysis
 
         except Exception as e:
             print(f"Error analyzing with Claude: {e}")
             analysis = f"Error during analysis: {str(e)}"
 
+        if score is None:
+            # Fall back to a middling score, marked as a failure so that it
+            # isn't cached
+            score = 5
+            if not analysis.startswith(_ANALYSIS_FAILURES):
+                analysis = f"Unable to analyze, no score was given: {analysis}"
+
         return score, analysis
 
+    async def analyze_codes_batch(
+        self, items: List[Tuple[str, str]]
+    ) -> List[Tuple[int, str]]:
+        """Analyze several formulas with a single Claude request.
+
+        Args:
+            items: List of (code, location) tuples
+
+        Returns:
+            List of (score: int 1-10, analysis: str), in the same order as items
+        """
+        if len(items) == 1:
+            code, location = items[0]
+            return [await self.analyze_code_with_claude(code, location)]
+
+        prompt = "Analyze each of the following formulas found in a spreadsheet for security risks.\n\n"
+        for i, (code, location) in enumerate(items, start=1):
+            prompt += f"Item {i} (Location: {location}):\n```\n{code}\n```\n\n"
+        prompt += f"""For each item provide:
+1. {SCORE_GUIDE}
+
+2. A brief analysis explaining the score (1-2 sentences)
+
+Respond with ONLY a JSON array holding one object per item, for example:
+[{{"id": 1, "score": <number>, "analysis": "<your analysis here>"}}]
+"""
+
+        from claude_agent_sdk import (
+            AssistantMessage,
+            ClaudeAgentOptions,
+            TextBlock,
+            query,
+        )
+
+        options = ClaudeAgentOptions(max_turns=1, system_prompt=SYSTEM_PROMPT)
+
+        texts = []
+
+        try:
+            async for message in query(prompt=prompt, options=options):
+                if isinstance(message, AssistantMessage):
+                    for block in message.content:
+                        if isinstance(block, TextBlock):
+                            texts.append(block.text)
+
+        except Exception as e:
+            print(f"Error analyzing with Claude: {e}")
+            return [(5, f"Error during analysis: {str(e)}")] * len(items)
+
+        parsed = _parse_batch_response("".join(texts))
+        results = []
+        for i, (code, location) in enumerate(items, start=1):
+            if i in parsed:
+                results.append(parsed[i])
+            else:
+                # Item missing from the batched response, ask about it on its own
+                results.append(await self.analyze_code_with_claude(code, location))
+
+        return results
+
+    async def _analyze_batches(
+        self, batches: List[List[Tuple[str, str]]]
+    ) -> List[List[Tuple[int, str]]]:
+        """Analyze batches concurrently, returning results in batch order."""
+        results = [None] * len(batches)
+        semaphore = anyio.Semaphore(ANALYSIS_CONCURRENCY)
+
+        async def analyze(index, batch):
+            async with semaphore:
+                results[index] = await self.analyze_codes_batch(batch)
+
+        async with anyio.create_task_group() as task_group:
+            for index, batch in enumerate(batches):
+                task_group.start_soon(analyze, index, batch)
+
+        return results
+
+    @staticmethod
+    def _print_scores(kind: str, findings: List[MacroFinding]):
+        """Print a score line for each finding, in one write."""
+        if findings:
+            print(
+                "\n".join(
+                    f"{kind} {finding.item_number}: {finding.location} - "
+                    f"Score: {finding.score}/10"
+                    for finding in findings
+                )
+            )
+
     async def scan_file(self):
         """Main scanning function."""
         if not self.load_spreadsheet():
             return False
 
+        from openpyxl.utils import get_column_letter
+
         print("\n=== Scanning for macros and suspicious code ===\n")
 
-        # 1. Detect VBA macros
+        # 1. Detect VBA macros (analyzed individually, modules can be large)
         print("Checking for VBA macros...")
         vba_macros = self.detect_vba_macros()
 
-        for location, code in vba_macros:
-            self.item_counter += 1
-            print(f"Analyzing VBA macro {self.item_counter}: {location}...")
+        vba_results = [self._cached_analysis(code) for _location, code in vba_macros]
+        pending = [i for i, result in enumerate(vba_results) if result is None]
+
+        print(
+            f"Analyzing {len(vba_macros)} VBA macro(s), "
+            f"{len(vba_macros) - len(pending)} already cached..."
+        )
+        claude_results = []
+
+        async def analyze_vba():
+            claude_results.extend(
+                await self._analyze_batches(
+                    [[(vba_macros[i][1], vba_macros[i][0])] for i in pending]
+                )
+            )
 
-            score, analysis = await self.analyze_code_with_claude(code, location)
+        def detect_formulas():
+            # Errors raised here would leave the task group as an ExceptionGroup
+            try:
+                return self.detect_formula_cells()
+            except Exception as e:
+                print(f"Error reading spreadsheet: {e}")
+                return None
+
+        # 2. Detect suspicious formulas. Reading the workbook blocks, so it runs
+        # in a worker thread while Claude looks at the VBA macros.
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(analyze_vba)
+            print("\nChecking for suspicious formulas...")
+            formula_cells = await anyio.to_thread.run_sync(detect_formulas)
+            if formula_cells is None:
+                # Don't wait on Claude for a scan that has already failed
+                task_group.cancel_scope.cancel()
+        if self.workbook is not None:
+            # Release the file handle held by the read-only workbook
+            self.workbook.close()
+        if formula_cells is None:
+            return False
 
-            finding = MacroFinding(
-                item_number=self.item_counter,
-                location=location,
-                code=code,
-                score=score,
-                analysis=analysis,
+        for i, [result] in zip(pending, claude_results):
+            self._store_analysis(vba_macros[i][1], result)
+            vba_results[i] = result
+
+        first_finding = len(self.findings)
+        item_numbers = count(self.item_counter + 1)
+        for item_number, (location, code), (score, analysis) in zip(
+            item_numbers, vba_macros, vba_results
+        ):
+            self.findings.append(
+                MacroFinding(
+                    item_number=item_number,
+                    location=location,
+                    code=code,
+                    score=score,
+                    analysis=analysis,
+                )
             )
-            self.findings.append(finding)
-            print(f"  Score: {score}/10")
-
-        # 2. Detect suspicious formulas
-        print("\nChecking for suspicious formulas...")
-        formula_cells = self.detect_formula_cells()
-
-        for location, formula, sheet_name, col, row in formula_cells:
-            self.item_counter += 1
-            print(f"Analyzing formula {self.item_counter}: {location}...")
-
-            score, analysis = await self.analyze_code_with_claude(formula, location)
-
-            col_letter = get_column_letter(col)
-            finding = MacroFinding(
-                item_number=self.item_counter,
-                location=location,
-                code=formula,
-                score=score,
-                analysis=analysis,
-                cell_reference=(sheet_name, col_letter, row),
+        self._print_scores("VBA macro", self.findings[first_finding:])
+        self.item_counter += len(vba_macros)
+
+        formula_results = [
+            _local_prescreen(formula) for _location, formula, *_ in formula_cells
+        ]
+        pending = [i for i, result in enumerate(formula_results) if result is None]
+
+        # Formulas are often filled down a column, only analyze each one once
+        unique_items = {}
+        for i in pending:
+            location, formula, *_ = formula_cells[i]
+            key = self._formula_dedup_key(formula)
+            if key not in unique_items and self._cached_analysis(formula) is None:
+                unique_items[key] = (formula, location)
+
+        print(
+            f"Found {len(formula_cells)} formula(s): "
+            f"{len(formula_cells) - len(pending)} scored locally, "
+            f"{len(unique_items)} unique formula(s) to analyze with Claude..."
+        )
+        formula_items = list(unique_items.values())
+        batches = [
+            formula_items[start : start + FORMULA_BATCH_SIZE]
+            for start in range(0, len(formula_items), FORMULA_BATCH_SIZE)
+        ]
+        batch_results = await self._analyze_batches(batches)
+        claude_results = [result for batch in batch_results for result in batch]
+        shared_results = {}
+        for key, (formula, _location), result in zip(
+            unique_items, formula_items, claude_results
+        ):
+            self._store_analysis(formula, result)
+            shared_results[key] = result
+        for i in pending:
+            formula = formula_cells[i][1]
+            formula_results[i] = (
+                self._cached_analysis(formula)
+                or shared_results[self._formula_dedup_key(formula)]
             )
-            self.findings.append(finding)
-            print(f"  Score: {score}/10")
+
+        first_finding = len(self.findings)
+        item_numbers = count(self.item_counter + 1)
+        for item_number, cell, (score, analysis) in zip(
+            item_numbers, formula_cells, formula_results
+        ):
+            location, formula, sheet_name, col, row = cell
+            self.findings.append(
+                MacroFinding(
+                    item_number=item_number,
+                    location=location,
+                    code=formula,
+                    score=score,
+                    analysis=analysis,
+                    cell_reference=(sheet_name, get_column_letter(col), row),
+                )
+            )
+        self._print_scores("Formula", self.findings[first_finding:])
+        self.item_counter += len(formula_cells)
 
         print(f"\n=== Scan complete: {len(self.findings)} items found ===\n")
         return True
 
     def generate_markdown_report(self) -> str:
         """Generate a markdown report of findings."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
 
-        report = f"""# Macro Security Analysis Report
+        parts = [f"""# Macro Security Analysis Report
 
 **File:** {self.input_file.name}
 **Scan Date:** {timestamp}
@@ -320,37 +1447,47 @@ ANALYSIS: <your analysis here>
 
 ## Summary
 
-"""
-
-        # Summary statistics
-        malicious = len([f for f in self.findings if f.score <= 3])
-        suspicious = len([f for f in self.findings if 4 <= f.score <= 6])
-        risky = len([f for f in self.findings if 7 <= f.score <= 9])
-        safe = len([f for f in self.findings if f.score == 10])
-
-        report += f"- **Malicious (1-3):** {malicious}\n"
-        report += f"- **Suspicious (4-6):** {suspicious}\n"
-        report += f"- **Potentially Risky (7-9):** {risky}\n"
-        report += f"- **Safe (10):** {safe}\n"
-        report += f"- **Items to be removed (score < {self.remove_threshold}):** "
-        report += (
-            f"{len([f for f in self.findings if f.score < self.remove_threshold])}\n\n"
+"""]
+
+        # Summary statistics, gathered in a single pass over the findings
+        malicious = suspicious = risky = safe = to_remove = 0
+        for finding in self.findings:
+            score = finding.score
+            if score <= 3:
+                malicious += 1
+            elif score <= 6:
+                suspicious += 1
+            elif score <= 9:
+                risky += 1
+            elif score == 10:
+                safe += 1
+            if score < self.remove_threshold:
+                to_remove += 1
+
+        parts.append(
+            f"- **Malicious (1-3):** {malicious}\n"
+            f"- **Suspicious (4-6):** {suspicious}\n"
+            f"- **Potentially Risky (7-9):** {risky}\n"
+            f"- **Safe (10):** {safe}\n"
+            f"- **Items to be removed (score < {self.remove_threshold}):** "
+            f"{to_remove}\n\n"
         )
 
         # Detailed findings
-        report += "## Detailed Findings\n\n"
-
-        for finding in sorted(self.findings, key=lambda x: x.score):
-            report += f"### Item #{finding.item_number}: {finding.location}\n\n"
-            report += f"**Score:** {finding.score}/10\n\n"
-            report += f"**Analysis:** {finding.analysis}\n\n"
-            report += f"**Code:**\n```\n{finding.code[:500]}"
+        parts.append("## Detailed Findings\n\n")
+
+        for finding in sorted(self.findings, key=attrgetter("score")):
+            parts.append(
+                f"### Item #{finding.item_number}: {finding.location}\n\n"
+                f"**Score:** {finding.score}/10\n\n"
+                f"**Analysis:** {finding.analysis}\n\n"
+                f"**Code:**\n```\n{finding.code[:500]}"
+            )
             if len(finding.code) > 500:
-                report += "\n... (truncated)"
-            report += "\n```\n\n"
-            report += "---\n\n"
+                parts.append("\n... (truncated)")
+            parts.append("\n```\n\n---\n\n")
 
-        return report
+        return "".join(parts)
 
     def create_sanitized_copy(self, output_file: Path):
         """Create a copy of the spreadsheet with suspicious cells highlighted/removed."""
@@ -360,32 +1497,30 @@ ANALYSIS: <your analysis here>
             return self._create_sanitized_ods(output_file)
         return False
 
+    def _removals(self) -> Dict[str, Dict[str, int]]:
+        """Map each sheet to the cells scored below the removal threshold.
+
+        Cells are keyed by their A1 reference and map to the finding's item number.
+        """
+        threshold = self.remove_threshold
+        removals: Dict[str, Dict[str, int]] = {}
+        for finding in self.findings:
+            if finding.score < threshold and finding.cell_reference:
+                sheet_name, col_letter, row = finding.cell_reference
+                removals.setdefault(sheet_name, {})[
+                    f"{col_letter}{row}"
+                ] = finding.item_number
+        return removals
+
     def _create_sanitized_excel(self, output_file: Path):
         """Create sanitized copy of Excel file."""
         try:
-            # Create a copy of the workbook
-            output_wb = load_workbook(self.input_file)
-
-            # Yellow fill for highlighted cells
-            yellow_fill = PatternFill(
-                start_color="FFFF00", end_color="FFFF00", fill_type="solid"
-            )
+            removals = self._removals()
+            items_removed = sum(len(cells) for cells in removals.values())
 
-            items_removed = 0
+            if not self._stream_sanitized_excel(output_file, removals):
+                self._save_sanitized_excel(output_file, removals)
 
-            for finding in self.findings:
-                if finding.score < self.remove_threshold and finding.cell_reference:
-                    sheet_name, col_letter, row = finding.cell_reference
-                    sheet = output_wb[sheet_name]
-                    cell = sheet[f"{col_letter}{row}"]
-
-                    # Replace with reference and highlight
-                    cell.value = f"CODE REMOVED: Item #{finding.item_number}"
-                    cell.fill = yellow_fill
-                    items_removed += 1
-
-            # Save the sanitized copy
-            output_wb.save(output_file)
             print(f"\nSanitized copy created: {output_file}")
             print(f"Items removed/highlighted: {items_removed}")
 
@@ -395,38 +1530,171 @@ ANALYSIS: <your analysis here>
             print(f"Error creating sanitized copy: {e}")
             return False
 
+    def _stream_sanitized_excel(
+        self, output_file: Path, removals: Dict[str, Dict[str, int]]
+    ) -> bool:
+        """Write the sanitized workbook by copying the package part by part.
+
+        Only the worksheets with removed cells, styles.xml and the parts that
+        refer to the VBA project are rewritten, everything else is copied
+        across as is. Returns False, without writing anything, for workbooks
+        this can't handle safely, including any holding macro carrying parts
+        other than a VBA project.
+        """
+        with zipfile.ZipFile(self.input_file) as archive:
+            try:
+                workbook, relationships, sheets = _xlsx_workbook_parts(archive)
+                dropped = _xlsx_macro_parts(archive)
+            except (KeyError, StopIteration):
+                return False
+            if dropped is None:
+                return False
+            names = set(archive.namelist())
+            dropped &= names
+            if not removals and not dropped:
+                # Nothing to rewrite and no macros to drop, the file's contents
+                # were checked above so it can be copied as is
+                shutil.copyfile(self.input_file, output_file)
+                return True
+            rewritten = {}
+
+            if removals:
+                styles = next(
+                    (
+                        target
+                        for rel_type, target in relationships.values()
+                        if rel_type.endswith("/styles")
+                    ),
+                    None,
+                )
+                if styles not in names:
+                    return False
+                highlight = _add_highlight_style(archive.read(styles))
+                if highlight is None:
+                    return False
+                rewritten[styles], style_id = highlight
+
+                for sheet_name, cells in removals.items():
+                    part = sheets.get(sheet_name)
+                    if part not in names:
+                        return False
+                    sheet = _replace_xlsx_cells(archive.read(part), cells, style_id)
+                    if sheet is None:
+                        return False
+                    rewritten[part] = sheet
+
+                # The calculation chain lists the replaced formulas, Excel
+                # rebuilds it when it's missing
+                dropped.update(
+                    target
+                    for rel_type, target in relationships.values()
+                    if rel_type.endswith("/calcChain")
+                )
+
+            dropped &= names
+            if dropped:
+                workbook_dir, workbook_name = posixpath.split(workbook)
+                workbook_rels = f"{workbook_dir}/_rels/{workbook_name}.rels".lstrip("/")
+                rewritten[workbook_rels] = _XLSX_RELATIONSHIP_RE.sub(
+                    lambda m: (
+                        b""
+                        if _xlsx_part_path(workbook_dir, m.group(1).decode()) in dropped
+                        else m.group(0)
+                    ),
+                    archive.read(workbook_rels),
+                )
+                rewritten["[Content_Types].xml"] = _XLSX_OVERRIDE_RE.sub(
+                    lambda m: b"" if m.group(1).decode() in dropped else m.group(0),
+                    archive.read("[Content_Types].xml"),
+                )
+
+            with zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED) as output:
+                for item in archive.infolist():
+                    if item.filename in dropped:
+                        continue
+                    info = zipfile.ZipInfo(item.filename, item.date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = item.external_attr
+                    if item.filename in rewritten:
+                        output.writestr(info, rewritten[item.filename])
+                        continue
+                    # Sized up front so large parts get ZIP64 headers
+                    info.file_size = item.file_size
+                    with archive.open(item) as src, output.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        return True
+
+    def _save_sanitized_excel(
+        self, output_file: Path, removals: Dict[str, Dict[str, int]]
+    ):
+        """Write the sanitized workbook by loading and re-saving it in openpyxl."""
+        from openpyxl import load_workbook
+        from openpyxl.styles import PatternFill
+
+        # Create a copy of the workbook, VBA projects aren't kept
+        output_wb = load_workbook(self.input_file)
+
+        # Yellow fill for highlighted cells
+        yellow_fill = PatternFill(
+            start_color="FFFF00", end_color="FFFF00", fill_type="solid"
+        )
+
+        for sheet_name, cells in removals.items():
+            sheet = output_wb[sheet_name]
+            for ref, item_number in cells.items():
+                # Replace with reference and highlight
+                cell = sheet[ref]
+                cell.value = f"CODE REMOVED: Item #{item_number}"
+                cell.fill = yellow_fill
+
+        # Save the sanitized copy
+        output_wb.save(output_file)
+
     def _create_sanitized_ods(self, output_file: Path):
         """Create sanitized copy of ODS file."""
-        try:
-            # Import needed for creating ODS elements
-            import shutil
+        if not HAS_ODFPY:
+            print("Error: odfpy not installed. Install with: pip install odfpy")
+            return False
 
+        try:
+            from odf.opendocument import load as load_odf
             from odf.style import Style, TableCellProperties
+            from odf.table import Table, TableRow
+            from odf.text import P
+            from openpyxl.utils.cell import coordinate_to_tuple
 
-            # Copy the original file
-            shutil.copy2(self.input_file, output_file)
-
-            # Load the copy
-            output_doc = load_odf(str(output_file))
+            # Load the original, the sanitized document is written out below
+            output_doc = load_odf(str(self.input_file))
 
             # Create yellow background style
             yellow_style = Style(name="YellowBackground", family="table-cell")
             yellow_style.addElement(TableCellProperties(backgroundcolor="#FFFF00"))
             output_doc.automaticstyles.addElement(yellow_style)
 
-            items_removed = 0
-
-            # Create a mapping of cells to remove
-            cells_to_sanitize = {}
-            for finding in self.findings:
-                if finding.score < self.remove_threshold and finding.cell_reference:
-                    sheet_name, col_letter, row = finding.cell_reference
-                    key = (sheet_name, row)
-                    if key not in cells_to_sanitize:
-                        cells_to_sanitize[key] = []
-                    cells_to_sanitize[key].append(
-                        (finding.cell_reference[1], finding.item_number)
-                    )
+            # Macros can't be edited out one by one like cells, so all of
+            # them go when any scored below the threshold
+            items_removed = sum(
+                1
+                for finding in self.findings
+                if finding.cell_reference is None
+                and finding.score < self.remove_threshold
+            )
+            if items_removed:
+                # odfpy writes the manifest from the parts it kept, so their
+                # entries go too
+                output_doc._extra = [
+                    part
+                    for part in output_doc._extra
+                    if not part.filename.startswith(_ODF_MACRO_DIRS)
+                ]
+
+            # Map (sheet_name, row, col) of each cell to remove to its item number
+            cells_to_sanitize = {
+                (sheet_name, *coordinate_to_tuple(ref)): item_num
+                for sheet_name, cells in self._removals().items()
+                for ref, item_num in cells.items()
+            }
 
             # Process tables
             tables = output_doc.spreadsheet.getElementsByType(Table)
@@ -434,39 +1702,47 @@ ANALYSIS: <your analysis here>
                 sheet_name = table.getAttribute("name") or "Sheet"
                 rows = table.getElementsByType(TableRow)
 
-                row_num = 0
+                next_row = 1
                 for row in rows:
-                    row_num += 1  # noqa: SIM113 - spreadsheet rows start at 1
-                    cells = row.getElementsByType(TableCell)
+                    # Numbered the same way as in _detect_ods_formulas
+                    row_num = next_row
+                    next_row += _odf_repeat_count(
+                        row.getAttribute("numberrowsrepeated")
+                    )
 
-                    col_num = 0
-                    for cell in cells:
-                        col_num += 1  # noqa: SIM113 - spreadsheet cols start at 1
+                    next_col = 1
+                    for cell in row.childNodes:
+                        if cell.nodeType != cell.ELEMENT_NODE or cell.qname[1] not in (
+                            "table-cell",
+                            "covered-table-cell",
+                        ):
+                            continue
+                        col_num = next_col
+                        next_col += _odf_repeat_count(
+                            cell.getAttribute("numbercolumnsrepeated")
+                        )
 
                         # Check if this cell should be sanitized
-                        key = (sheet_name, row_num)
-                        if key in cells_to_sanitize:
-                            col_letter = get_column_letter(col_num)
-                            for target_col, item_num in cells_to_sanitize[key]:
-                                if col_letter == target_col:
-                                    # Remove formula
-                                    cell.removeAttribute("formula")
-
-                                    # Set text content
-                                    # Remove existing text
-                                    for p in cell.getElementsByType(P):
-                                        cell.removeChild(p)
-
-                                    # Add new text
-                                    from odf.text import P as Paragraph
-
-                                    p = Paragraph()
-                                    p.addText(f"CODE REMOVED: Item #{item_num}")
-                                    cell.addElement(p)
-
-                                    # Apply yellow style
-                                    cell.setAttribute("stylename", yellow_style)
-                                    items_removed += 1
+                        item_num = cells_to_sanitize.get((sheet_name, row_num, col_num))
+                        if item_num is None:
+                            continue
+
+                        # Remove formula
+                        cell.removeAttribute("formula")
+
+                        # Set text content
+                        # Remove existing text
+                        for p in cell.getElementsByType(P):
+                            cell.removeChild(p)
+
+                        # Add new text
+                        p = P()
+                        p.addText(f"CODE REMOVED: Item #{item_num}")
+                        cell.addElement(p)
+
+                        # Apply yellow style
+                        cell.setAttribute("stylename", yellow_style)
+                        items_removed += 1
 
             # Save the sanitized copy
             output_doc.save(output_file)
@@ -1,17 +1,24 @@
 """Command-line interface for Spreadsheet Safety Check."""
 
 import argparse
+import importlib.util
+import os
 import sys
-from datetime import datetime
+import time
+from functools import lru_cache
 from pathlib import Path
 
 import anyio
 
-from spreadsheet_safety_check.checker import MacroChecker
+# uvloop is an optional speedup, see the "fast" extra
+HAS_UVLOOP = importlib.util.find_spec("uvloop") is not None
 
+_SUPPORTED_SUFFIXES = frozenset({".xlsx", ".xlsm", ".ods"})
 
-async def main():
-    """Main CLI entry point."""
+
+@lru_cache(maxsize=None)
+def _get_parser() -> argparse.ArgumentParser:
+    """Build the argument parser, once per process."""
     parser = argparse.ArgumentParser(
         description="Detect and analyze macros/code in spreadsheets (Excel and OpenOffice)"
     )
@@ -28,16 +35,30 @@ async def main():
         "--output-dir",
         help="Directory for output files (default: same as input file)",
     )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for results cached between runs "
+        "(default: ~/.cache/spreadsheet-safety-check, or under $XDG_CACHE_HOME)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write cached results",
+    )
+    return parser
 
-    args = parser.parse_args()
+
+async def main():
+    """Main CLI entry point."""
+    args = _get_parser().parse_args()
 
     # Validate input file
-    input_path = Path(args.input_file)
-    if not input_path.exists():
-        print(f"Error: Input file not found: {input_path}")
+    if not os.path.exists(args.input_file):
+        print(f"Error: Input file not found: {args.input_file}")
         sys.exit(1)
 
-    if input_path.suffix.lower() not in [".xlsx", ".xlsm", ".ods"]:
+    input_path = Path(args.input_file)
+    if input_path.suffix.lower() not in _SUPPORTED_SUFFIXES:
         print("Error: Unsupported file format. Use .xlsx, .xlsm, or .ods files")
         sys.exit(1)
 
@@ -48,8 +69,15 @@ async def main():
     else:
         output_dir = input_path.parent
 
+    # Only load the checker once the arguments are known to be good
+    from spreadsheet_safety_check.checker import DEFAULT_CACHE_DIR, MacroChecker
+
     # Create checker instance
-    checker = MacroChecker(input_path, args.remove_threshold)
+    if args.no_cache:
+        cache_dir = None
+    else:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else DEFAULT_CACHE_DIR
+    checker = MacroChecker(input_path, args.remove_threshold, cache_dir=cache_dir)
 
     # Scan the file
     success = await checker.scan_file()
@@ -59,7 +87,7 @@ async def main():
         sys.exit(1)
 
     # Generate report
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
     report_file = output_dir / f"{input_path.stem}_report_{timestamp}.md"
 
     report_content = checker.generate_markdown_report()
@@ -78,7 +106,7 @@ async def main():
 
 def cli_entry_point():
     """Entry point for console scripts."""
-    anyio.run(main)
+    anyio.run(main, backend="asyncio", backend_options={"use_uvloop": HAS_UVLOOP})
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 """Pytest configuration and fixtures."""
 
 import pytest
+from odf import namespaces
+from odf.opendocument import OpenDocumentSpreadsheet
+from odf.table import Table, TableCell, TableRow
+from odf.text import P
 from openpyxl import Workbook
 
 
@@ -37,6 +41,58 @@ def temp_xlsm_file(tmp_path):
     return file_path
 
 
+@pytest.fixture
+def temp_ods_file(tmp_path):
+    """Create a temporary OpenOffice spreadsheet for testing."""
+    file_path = tmp_path / "test_spreadsheet.ods"
+    doc = OpenDocumentSpreadsheet()
+    table = Table(name="TestSheet")
+
+    # Same layout as temp_xlsx_file, one value per row in column A
+    for value in [
+        "Hello",
+        "of:=SUM(1;2)",  # Simple formula
+        'of:=HYPERLINK("http://example.com";"Click me")',  # Potentially suspicious
+    ]:
+        row = TableRow()
+        cell = TableCell()
+        if value.startswith("of:"):
+            cell.setAttrNS(namespaces.TABLENS, "formula", value)
+        else:
+            cell.addElement(P(text=value))
+        row.addElement(cell)
+        table.addElement(row)
+
+    doc.spreadsheet.addElement(table)
+    doc.save(str(file_path))
+    return file_path
+
+
+@pytest.fixture
+def fake_vba_parser(monkeypatch):
+    """Replace oletools' VBA_Parser with a stub holding one macro module.
+
+    Returns the list of file names the stub was asked to parse.
+    """
+    parsed = []
+
+    class FakeVBAParser:
+        def __init__(self, filename):
+            parsed.append(filename)
+
+        def detect_vba_macros(self):
+            return True
+
+        def extract_macros(self):
+            yield ("", "", "Module1", "Sub AutoOpen()\nEnd Sub")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr("oletools.olevba.VBA_Parser", FakeVBAParser)
+    return parsed
+
+
 @pytest.fixture
 def sample_vba_code():
     """Sample VBA code for testing."""
@@ -1,10 +1,82 @@
 """Tests for the MacroChecker class."""
 
+import dataclasses
+import sys
+import zipfile
 from pathlib import Path
 
+import anyio
 import pytest
+from odf.opendocument import OpenDocumentSpreadsheet
+from odf.table import CoveredTableCell, Table, TableCell, TableRow
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.formula import ArrayFormula
 
-from spreadsheet_safety_check.checker import MacroChecker, MacroFinding
+from spreadsheet_safety_check.checker import (
+    MacroChecker,
+    MacroFinding,
+    _local_prescreen,
+    _parse_batch_response,
+    _parse_score_response,
+    _read_cache,
+    _replace_xlsx_cells,
+    _write_cache,
+)
+
+
+def _add_xlsx_parts(
+    source, target, relationship, content_type, parts, workbook_sheet=b""
+):
+    """Copy a workbook, adding parts linked from the workbook."""
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            if item.filename == "xl/_rels/workbook.xml.rels":
+                data = data.replace(
+                    b"</Relationships>", relationship + b"</Relationships>"
+                )
+            elif item.filename == "[Content_Types].xml":
+                data = data.replace(b"</Types>", content_type + b"</Types>")
+            elif item.filename == "xl/workbook.xml" and workbook_sheet:
+                data = data.replace(b"</sheets>", workbook_sheet + b"</sheets>")
+            dst.writestr(item, data)
+        for name, data in parts.items():
+            dst.writestr(name, data)
+
+
+_ODS_MACRO_PARTS = {
+    "Basic/Standard/Module1.xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<script:module xmlns:script="http://openoffice.org/2000/script" '
+        'script:name="Module1" script:language="StarBasic">'
+        'Sub Main\n  Shell("calc.exe")\nEnd Sub\n</script:module>'
+    ),
+    "Basic/Standard/script-lb.xml": (
+        '<library:library xmlns:library="http://openoffice.org/2000/library"/>'
+    ),
+    "Scripts/python/evil.py": "import os\nos.system('calc.exe')\n",
+}
+
+
+def _add_ods_parts(source, target, parts):
+    """Copy an ODS file, adding parts listed in its manifest."""
+    entries = "".join(
+        f'<manifest:file-entry manifest:full-path="{name}" '
+        'manifest:media-type="text/xml"/>'
+        for name in parts
+    )
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            if item.filename == "META-INF/manifest.xml":
+                data = data.replace(
+                    b"</manifest:manifest>",
+                    entries.encode() + b"</manifest:manifest>",
+                )
+            dst.writestr(item, data)
+        for name, data in parts.items():
+            dst.writestr(name, data)
 
 
 class TestMacroFinding:
@@ -27,6 +99,20 @@ class TestMacroFinding:
         assert finding.analysis == "Safe formula"
         assert finding.cell_reference is None
 
+    @pytest.mark.skipif(sys.version_info < (3, 10), reason="needs Python 3.10+")
+    def test_macro_finding_has_no_instance_dict(self):
+        """Test that MacroFinding uses slots instead of a per-instance dict."""
+        finding = MacroFinding(1, "Sheet1!A1", "=SUM(1,2)", 10, "Safe formula")
+
+        assert not hasattr(finding, "__dict__")
+
+    def test_macro_finding_is_immutable(self):
+        """Test that findings can't be changed once created."""
+        finding = MacroFinding(1, "Sheet1!A1", "=SUM(1,2)", 10, "Safe formula")
+
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            finding.score = 1
+
     def test_macro_finding_with_cell_reference(self):
         """Test MacroFinding with cell reference."""
         finding = MacroFinding(
@@ -63,6 +149,24 @@ class TestMacroChecker:
         assert checker.file_type == "excel"
         assert checker.workbook is not None
 
+    def test_load_ods_spreadsheet(self, temp_ods_file):
+        """Test loading an OpenOffice spreadsheet."""
+        checker = MacroChecker(temp_ods_file)
+        result = checker.load_spreadsheet()
+
+        assert result is True
+        assert checker.file_type == "ods"
+
+    def test_load_invalid_ods_spreadsheet(self, tmp_path):
+        """Test loading a .ods file that isn't an OpenDocument archive."""
+        invalid_file = tmp_path / "invalid.ods"
+        invalid_file.write_text("not a spreadsheet")
+
+        checker = MacroChecker(invalid_file)
+        result = checker.load_spreadsheet()
+
+        assert result is False
+
     def test_load_unsupported_file(self, tmp_path):
         """Test loading an unsupported file format."""
         unsupported_file = tmp_path / "test.txt"
@@ -73,6 +177,98 @@ class TestMacroChecker:
 
         assert result is False
 
+    def test_detect_vba_macros_skips_plain_xlsx(self, temp_xlsx_file, monkeypatch):
+        """Test that .xlsx files without a VBA project aren't parsed by oletools."""
+
+        def fail_vba_parser(*args, **kwargs):
+            raise AssertionError("VBA_Parser should not be used")
+
+        monkeypatch.setattr("oletools.olevba.VBA_Parser", fail_vba_parser)
+        checker = MacroChecker(temp_xlsx_file)
+
+        assert checker.detect_vba_macros() == []
+
+    def test_detect_vba_macros_checks_renamed_workbook(self, tmp_path, fake_vba_parser):
+        """Test that an .xlsx file carrying a VBA project is still parsed."""
+        file_path = tmp_path / "renamed.xlsx"
+        with zipfile.ZipFile(file_path, "w") as archive:
+            archive.writestr("xl/vbaProject.bin", b"")
+        checker = MacroChecker(file_path)
+
+        macros = checker.detect_vba_macros()
+
+        assert fake_vba_parser == [str(file_path)]
+        assert macros == [("VBA Module: Module1", "Sub AutoOpen()\nEnd Sub")]
+
+    def test_detect_vba_macros_finds_renamed_vba_part(
+        self, temp_xlsx_file, tmp_path, fake_vba_parser
+    ):
+        """Test that a VBA project is found by relationship, not by part name."""
+        file_path = tmp_path / "renamed.xlsx"
+        _add_xlsx_parts(
+            temp_xlsx_file,
+            file_path,
+            b'<Relationship Id="rIdVba" Target="payload.bin" '
+            b'Type="http://schemas.microsoft.com/office/2006/'
+            b'relationships/vbaProject"/>',
+            b"",
+            {"xl/payload.bin": b"not really VBA"},
+        )
+
+        macros = MacroChecker(file_path).detect_vba_macros()
+
+        assert fake_vba_parser == [str(file_path)]
+        assert macros == [("VBA Module: Module1", "Sub AutoOpen()\nEnd Sub")]
+
+    def test_detect_vba_macros_uses_cache(self, tmp_path, fake_vba_parser):
+        """Test that VBA extraction is cached by file contents between runs."""
+        file_path = tmp_path / "macros.xlsm"
+        file_path.write_bytes(b"macro workbook")
+        cache_dir = tmp_path / "cache"
+
+        first = MacroChecker(file_path, cache_dir=cache_dir).detect_vba_macros()
+        second = MacroChecker(file_path, cache_dir=cache_dir).detect_vba_macros()
+        file_path.write_bytes(b"changed workbook")
+        third = MacroChecker(file_path, cache_dir=cache_dir).detect_vba_macros()
+
+        assert first == second == third
+        assert second == [("VBA Module: Module1", "Sub AutoOpen()\nEnd Sub")]
+        # Parsed once for each distinct file content
+        assert len(fake_vba_parser) == 2
+
+    @pytest.mark.parametrize(
+        "entry",
+        [b'{"Module1": "Sub X()"}', b'[["Module1"]]', b'[["Module1", 1]]', b"[["],
+    )
+    def test_detect_vba_macros_ignores_bad_cache(
+        self, tmp_path, fake_vba_parser, entry
+    ):
+        """Test that a malformed VBA cache entry falls back to oletools."""
+        file_path = tmp_path / "macros.xlsm"
+        file_path.write_bytes(b"macro workbook")
+        checker = MacroChecker(file_path, cache_dir=tmp_path / "cache")
+        cache_path = checker._vba_cache_path()
+        cache_path.parent.mkdir(parents=True)
+        cache_path.write_bytes(entry)
+
+        macros = checker.detect_vba_macros()
+
+        assert macros == [("VBA Module: Module1", "Sub AutoOpen()\nEnd Sub")]
+        assert len(fake_vba_parser) == 1
+        assert _read_cache(cache_path, "VBA") == [list(macros[0])]
+
+    @pytest.mark.parametrize("has_orjson", [True, False])
+    def test_cache_round_trip(self, tmp_path, monkeypatch, has_orjson):
+        """Test that cache entries read back the same with or without orjson."""
+        if has_orjson:
+            pytest.importorskip("orjson")
+        monkeypatch.setattr("spreadsheet_safety_check.checker.HAS_ORJSON", has_orjson)
+        path = tmp_path / "cache" / "entry.json"
+
+        _write_cache(path, [("VBA Module: Módulo1", "Sub X()\nEnd Sub")], "VBA")
+
+        assert _read_cache(path, "VBA") == [["VBA Module: Módulo1", "Sub X()\nEnd Sub"]]
+
     def test_detect_excel_formulas(self, temp_xlsx_file):
         """Test detecting formulas in Excel files."""
         checker = MacroChecker(temp_xlsx_file)
@@ -85,6 +281,141 @@ class TestMacroChecker:
         assert any("SUM" in formula[1] for formula in formulas)
         assert any("HYPERLINK" in formula[1] for formula in formulas)
 
+    def test_detect_excel_shared_and_array_formulas(self, tmp_path):
+        """Test that shared formulas are expanded and array formulas found."""
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = "Data"
+        for row in (1, 2, 3):
+            sheet[f"B{row}"] = f"=A{row}*2"
+        sheet["C1"] = ArrayFormula("C1:C2", '=WEBSERVICE("http://x")')
+        plain_file = tmp_path / "plain.xlsx"
+        workbook.save(plain_file)
+
+        # openpyxl doesn't write shared formulas, turn column B into one
+        file_path = tmp_path / "shared.xlsx"
+        with zipfile.ZipFile(plain_file) as src, zipfile.ZipFile(file_path, "w") as dst:
+            for item in src.infolist():
+                data = src.read(item)
+                if item.filename == "xl/worksheets/sheet1.xml":
+                    data = data.replace(
+                        b"<f>A1*2</f>", b'<f t="shared" ref="B1:B3" si="0">A1*2</f>'
+                    )
+                    for row in (b"2", b"3"):
+                        data = data.replace(
+                            b"<f>A" + row + b"*2</f>", b'<f t="shared" si="0"/>'
+                        )
+                    assert data.count(b'si="0"') == 3
+                dst.writestr(item, data)
+
+        checker = MacroChecker(file_path)
+        checker.load_spreadsheet()
+
+        assert [cell[:2] for cell in checker.detect_formula_cells()] == [
+            ("Data!B1", "=A1*2"),
+            ("Data!C1", '=WEBSERVICE("http://x")'),
+            ("Data!B2", "=A2*2"),
+            ("Data!B3", "=A3*2"),
+        ]
+
+    def test_detect_ods_formulas(self, temp_ods_file):
+        """Test detecting formulas in OpenOffice files."""
+        checker = MacroChecker(temp_ods_file)
+        checker.load_spreadsheet()
+
+        formulas = checker.detect_formula_cells()
+
+        assert formulas == [
+            ("TestSheet!A2", "of:=SUM(1;2)", "TestSheet", 1, 2),
+            (
+                "TestSheet!A3",
+                'of:=HYPERLINK("http://example.com";"Click me")',
+                "TestSheet",
+                1,
+                3,
+            ),
+        ]
+
+    def test_detect_ods_macros(self, temp_ods_file, tmp_path):
+        """Test that OpenOffice Basic modules and scripts are extracted."""
+        file_path = tmp_path / "macros.ods"
+        _add_ods_parts(temp_ods_file, file_path, _ODS_MACRO_PARTS)
+
+        checker = MacroChecker(file_path)
+        checker.load_spreadsheet()
+
+        assert checker.detect_vba_macros() == [
+            (
+                "Basic Module: Standard/Module1",
+                'Sub Main\n  Shell("calc.exe")\nEnd Sub\n',
+            ),
+            ("Script: python/evil.py", "import os\nos.system('calc.exe')\n"),
+        ]
+
+    def test_detect_ods_formulas_repeated_cells(self, tmp_path):
+        """Test that repeated and covered ODS cells keep columns aligned."""
+        file_path = tmp_path / "repeated.ods"
+        doc = OpenDocumentSpreadsheet()
+        table = Table(name="Sheet1")
+
+        row = TableRow()
+        row.addElement(TableCell(numbercolumnsrepeated=3))
+        row.addElement(TableCell(formula="of:=SUM([.A2])"))
+        table.addElement(row)
+        table.addElement(TableRow(numberrowsrepeated=4))
+        row = TableRow()
+        row.addElement(TableCell(numbercolumnsspanned=2))
+        row.addElement(CoveredTableCell(formula='of:=EXEC("calc.exe")'))
+        table.addElement(row)
+
+        doc.spreadsheet.addElement(table)
+        doc.save(str(file_path))
+
+        checker = MacroChecker(file_path)
+        checker.load_spreadsheet()
+        formulas = checker.detect_formula_cells()
+
+        assert [formula[0] for formula in formulas] == ["Sheet1!D1", "Sheet1!B6"]
+
+        # The sanitizer must find the same cells
+        checker.findings = [
+            MacroFinding(
+                1, location, code, 1, "Bad", (sheet, get_column_letter(col), row)
+            )
+            for location, code, sheet, col, row in formulas
+        ]
+        output_file = tmp_path / "sanitized.ods"
+        checker.create_sanitized_copy(output_file)
+
+        sanitized = MacroChecker(output_file)
+        sanitized.load_spreadsheet()
+        assert sanitized.detect_formula_cells() == []
+
+    def test_detect_excel_formulas_ignores_stored_dimensions(self, tmp_path):
+        """Test that formulas outside a sheet's declared size are still found."""
+        source = tmp_path / "source.xlsx"
+        wb = Workbook()
+        wb.active["C5"] = '=EXEC("calc.exe")'
+        wb.save(source)
+
+        # Rewrite the sheet so it claims to only contain A1
+        file_path = tmp_path / "hidden.xlsx"
+        with zipfile.ZipFile(source) as zin, zipfile.ZipFile(file_path, "w") as zout:
+            for item in zin.infolist():
+                data = zin.read(item)
+                if item.filename == "xl/worksheets/sheet1.xml":
+                    data = data.replace(
+                        b'<dimension ref="C5:C5" />', b'<dimension ref="A1" />'
+                    )
+                zout.writestr(item, data)
+
+        checker = MacroChecker(file_path)
+        checker.load_spreadsheet()
+
+        formulas = checker.detect_formula_cells()
+
+        assert [formula[0] for formula in formulas] == ["Sheet!C5"]
+
     def test_generate_markdown_report_empty(self, temp_xlsx_file):
         """Test generating a report with no findings."""
         checker = MacroChecker(temp_xlsx_file)
@@ -119,6 +450,263 @@ class TestMacroChecker:
         assert "=SUM(1,2)" in report
         assert "Safe formula" in report
 
+    def test_removals(self, temp_xlsx_file):
+        """Test that only located findings below the threshold are removed."""
+        checker = MacroChecker(temp_xlsx_file, remove_threshold=5)
+        checker.findings = [
+            MacroFinding(1, "S!A2", "=SUM(1,2)", 10, "Safe", ("S", "A", 2)),
+            MacroFinding(2, "S!B3", "=EXEC()", 1, "Bad", ("S", "B", 3)),
+            MacroFinding(3, "Module1", "Shell", 0, "Bad"),
+            MacroFinding(4, "T!C4", "=CALL()", 4, "Bad", ("T", "C", 4)),
+        ]
+
+        assert checker._removals() == {"S": {"B3": 2}, "T": {"C4": 4}}
+
+    def test_create_sanitized_excel(self, temp_xlsx_file, tmp_path):
+        """Test that low scoring formulas are replaced in the sanitized copy."""
+        checker = MacroChecker(temp_xlsx_file, remove_threshold=5)
+        checker.load_spreadsheet()
+        checker.findings = [
+            MacroFinding(
+                1, "TestSheet!A2", "=SUM(1,2)", 10, "Safe", ("TestSheet", "A", 2)
+            ),
+            MacroFinding(
+                2, "TestSheet!A3", "=HYPERLINK()", 3, "Bad", ("TestSheet", "A", 3)
+            ),
+        ]
+        output_file = tmp_path / "sanitized.xlsx"
+
+        assert checker.create_sanitized_copy(output_file) is True
+
+        sheet = load_workbook(output_file)["TestSheet"]
+        assert sheet["A2"].value == "=SUM(1,2)"
+        assert sheet["A3"].value == "CODE REMOVED: Item #2"
+        assert sheet["A3"].fill.start_color.rgb == "00FFFF00"
+
+    def test_create_sanitized_excel_without_removals(self, temp_xlsx_file, tmp_path):
+        """Test that a file with nothing to remove is copied unchanged."""
+        checker = MacroChecker(temp_xlsx_file, remove_threshold=5)
+        checker.load_spreadsheet()
+        checker.findings = [
+            MacroFinding(
+                1, "TestSheet!A2", "=SUM(1,2)", 10, "Safe", ("TestSheet", "A", 2)
+            ),
+        ]
+        output_file = tmp_path / "sanitized.xlsx"
+
+        assert checker.create_sanitized_copy(output_file) is True
+
+        assert output_file.read_bytes() == temp_xlsx_file.read_bytes()
+
+    def test_create_sanitized_excel_renamed_workbook_without_removals(
+        self, temp_xlsx_file, tmp_path
+    ):
+        """Test that a macro workbook renamed to .xlsx isn't copied unchanged."""
+        renamed_file = tmp_path / "renamed.xlsx"
+        _add_xlsx_parts(
+            temp_xlsx_file,
+            renamed_file,
+            b'<Relationship Id="rIdVba" Target="vbaProject.bin" '
+            b'Type="http://schemas.microsoft.com/office/2006/'
+            b'relationships/vbaProject"/>',
+            b'<Override PartName="/xl/vbaProject.bin" '
+            b'ContentType="application/vnd.ms-office.vbaProject"/>',
+            {"xl/vbaProject.bin": b"not really VBA"},
+        )
+        checker = MacroChecker(renamed_file, remove_threshold=5)
+        checker.load_spreadsheet()
+        output_file = tmp_path / "sanitized.xlsx"
+
+        assert checker.create_sanitized_copy(output_file) is True
+
+        with zipfile.ZipFile(output_file) as out:
+            assert "xl/vbaProject.bin" not in out.namelist()
+            assert b"vbaProject" not in out.read("xl/_rels/workbook.xml.rels")
+
+    def test_create_sanitized_excel_drops_vba_project(self, temp_xlsx_file, tmp_path):
+        """Test that the streamed copy drops macros and only rewrites edited parts."""
+        macro_file = tmp_path / "macros.xlsm"
+        _add_xlsx_parts(
+            temp_xlsx_file,
+            macro_file,
+            b'<Relationship Id="rIdVba" Target="vbaProject.bin" '
+            b'Type="http://schemas.microsoft.com/office/2006/'
+            b'relationships/vbaProject"/>',
+            b'<Override PartName="/xl/vbaProject.bin" '
+            b'ContentType="application/vnd.ms-office.vbaProject"/>',
+            {"xl/vbaProject.bin": b"not really VBA"},
+        )
+
+        checker = MacroChecker(macro_file, remove_threshold=5)
+        checker.findings = [
+            MacroFinding(
+                1, "TestSheet!A3", "=HYPERLINK()", 3, "Bad", ("TestSheet", "A", 3)
+            ),
+        ]
+        output_file = tmp_path / "sanitized.xlsm"
+
+        assert checker._create_sanitized_excel(output_file) is True
+
+        assert load_workbook(output_file)["TestSheet"]["A3"].value == (
+            "CODE REMOVED: Item #1"
+        )
+        with zipfile.ZipFile(macro_file) as src, zipfile.ZipFile(output_file) as out:
+            assert "xl/vbaProject.bin" not in out.namelist()
+            assert b"vbaProject" not in out.read("xl/_rels/workbook.xml.rels")
+            assert b"vbaProject" not in out.read("[Content_Types].xml")
+            assert out.read("xl/workbook.xml") == src.read("xl/workbook.xml")
+
+    def test_create_sanitized_excel_drops_renamed_vba_project(
+        self, temp_xlsx_file, tmp_path
+    ):
+        """Test that VBA parts are found by relationship, whatever their name."""
+        macro_file = tmp_path / "macros.xlsm"
+        _add_xlsx_parts(
+            temp_xlsx_file,
+            macro_file,
+            b'<Relationship Id="rIdVba" Target="payload.bin" '
+            b'Type="http://schemas.microsoft.com/office/2006/'
+            b'relationships/vbaProject"/>',
+            b"",
+            {
+                "xl/payload.bin": b"not really VBA",
+                "xl/_rels/payload.bin.rels": (
+                    b'<Relationships xmlns="http://schemas.openxmlformats.org/'
+                    b'package/2006/relationships"><Relationship Id="rId1" '
+                    b'Target="extra.bin" Type="http://schemas.microsoft.com/'
+                    b'office/2006/relationships/vbaProjectSignature"/>'
+                    b"</Relationships>"
+                ),
+                "xl/extra.bin": b"not really a signature",
+            },
+        )
+        checker = MacroChecker(macro_file, remove_threshold=5)
+        output_file = tmp_path / "sanitized.xlsm"
+
+        assert checker._stream_sanitized_excel(output_file, {}) is True
+
+        with zipfile.ZipFile(output_file) as out:
+            assert not {
+                "xl/payload.bin",
+                "xl/_rels/payload.bin.rels",
+                "xl/extra.bin",
+            } & set(out.namelist())
+            assert b"payload.bin" not in out.read("xl/_rels/workbook.xml.rels")
+        assert load_workbook(output_file)["TestSheet"]["A1"].value == "Hello"
+
+    def test_create_sanitized_excel_drops_xlm_macrosheet(
+        self, temp_xlsx_file, tmp_path
+    ):
+        """Test that workbooks with XLM macro sheets are re-saved by openpyxl."""
+        macro_file = tmp_path / "macros.xlsm"
+        _add_xlsx_parts(
+            temp_xlsx_file,
+            macro_file,
+            b'<Relationship Id="rIdXlm" Target="macrosheets/sheet1.xml" '
+            b'Type="http://schemas.microsoft.com/office/2006/'
+            b'relationships/xlMacrosheet"/>',
+            b'<Override PartName="/xl/macrosheets/sheet1.xml" '
+            b'ContentType="application/vnd.ms-excel.macrosheet+xml"/>',
+            {
+                "xl/macrosheets/sheet1.xml": (
+                    b'<xm:macrosheet xmlns="http://schemas.openxmlformats.org/'
+                    b'spreadsheetml/2006/main" xmlns:xm="http://schemas.'
+                    b'microsoft.com/office/excel/2006/main"><sheetData><row '
+                    b'r="1"><c r="A1"><f>EXEC("calc.exe")</f></c></row>'
+                    b"</sheetData></xm:macrosheet>"
+                ),
+            },
+            b'<sheet name="Macro1" sheetId="9" r:id="rIdXlm" xmlns:r="http://'
+            b'schemas.openxmlformats.org/officeDocument/2006/relationships"/>',
+        )
+        checker = MacroChecker(macro_file, remove_threshold=5)
+        output_file = tmp_path / "sanitized.xlsm"
+
+        assert checker._stream_sanitized_excel(output_file, {}) is False
+        assert not output_file.exists()
+        assert checker._create_sanitized_excel(output_file) is True
+
+        with zipfile.ZipFile(output_file) as out:
+            # openpyxl writes the macro sheet back as a plain worksheet
+            assert not any("macrosheet" in name for name in out.namelist())
+            assert b"macrosheet" not in out.read("[Content_Types].xml")
+            assert b"Macrosheet" not in out.read("xl/_rels/workbook.xml.rels")
+
+    def test_replace_xlsx_cells_skips_shared_formulas(self):
+        """Test that cells other formulas depend on are left for openpyxl."""
+        sheet = (
+            b'<sheetData><row r="1"><c r="A1"><f t="shared" ref="A1:A2" si="0">'
+            b'B1</f><v>1</v></c></row><row r="2"><c r="A2"><f t="shared" si="0"/>'
+            b"<v>2</v></c></row></sheetData>"
+        )
+
+        assert _replace_xlsx_cells(sheet, {"A1": 1}, 5) is None
+        assert b'<c r="A2" s="5" t="inlineStr"><is><t>CODE REMOVED: Item #2' in (
+            _replace_xlsx_cells(sheet, {"A2": 2}, 5)
+        )
+
+    def test_create_sanitized_ods(self, temp_ods_file, tmp_path):
+        """Test that low scoring formulas are replaced in a sanitized ODS copy."""
+        checker = MacroChecker(temp_ods_file, remove_threshold=5)
+        checker.load_spreadsheet()
+        checker.findings = [
+            MacroFinding(
+                1, "TestSheet!A2", "of:=SUM(1;2)", 10, "Safe", ("TestSheet", "A", 2)
+            ),
+            MacroFinding(
+                2, "TestSheet!A3", "of:=HYPERLINK()", 3, "Bad", ("TestSheet", "A", 3)
+            ),
+        ]
+        output_file = tmp_path / "sanitized.ods"
+
+        assert checker.create_sanitized_copy(output_file) is True
+
+        sanitized = MacroChecker(output_file)
+        sanitized.load_spreadsheet()
+        assert [f[0] for f in sanitized.detect_formula_cells()] == ["TestSheet!A2"]
+        with zipfile.ZipFile(output_file) as archive:
+            assert b"CODE REMOVED: Item #2" in archive.read("content.xml")
+
+    @pytest.mark.parametrize("score, kept", [(1, False), (9, True)])
+    def test_create_sanitized_ods_drops_macros(
+        self, temp_ods_file, tmp_path, score, kept
+    ):
+        """Test that ODS macros are dropped when any scored below the threshold."""
+        file_path = tmp_path / "macros.ods"
+        _add_ods_parts(temp_ods_file, file_path, _ODS_MACRO_PARTS)
+        checker = MacroChecker(file_path, remove_threshold=5)
+        checker.load_spreadsheet()
+        checker.findings = [
+            MacroFinding(1, "Basic Module: Standard/Module1", "Shell", score, "Bad"),
+            MacroFinding(2, "Script: python/evil.py", "os.system", 9, "Fine"),
+        ]
+        output_file = tmp_path / "sanitized.ods"
+
+        assert checker.create_sanitized_copy(output_file) is True
+
+        with zipfile.ZipFile(output_file) as archive:
+            names = archive.namelist()
+            manifest = archive.read("META-INF/manifest.xml")
+        for name in _ODS_MACRO_PARTS:
+            assert (name in names) is kept
+            assert (name.encode() in manifest) is kept
+
+    def test_generate_markdown_report_summary_counts(self, temp_xlsx_file):
+        """Test the per-category counts in the report summary."""
+        checker = MacroChecker(temp_xlsx_file, remove_threshold=5)
+        checker.findings = [
+            MacroFinding(i, f"A{i}", "code", score, "analysis")
+            for i, score in enumerate([1, 3, 4, 6, 7, 9, 10, 10], start=1)
+        ]
+
+        report = checker.generate_markdown_report()
+
+        assert "- **Malicious (1-3):** 2\n" in report
+        assert "- **Suspicious (4-6):** 2\n" in report
+        assert "- **Potentially Risky (7-9):** 2\n" in report
+        assert "- **Safe (10):** 2\n" in report
+        assert "- **Items to be removed (score < 5):** 3\n" in report
+
     @pytest.mark.asyncio
     async def test_analyze_code_with_claude_format(self, monkeypatch):
         """Test Claude analysis response parsing."""
@@ -137,7 +725,7 @@ class TestMacroChecker:
                 model="claude-test",
             )
 
-        monkeypatch.setattr("spreadsheet_safety_check.checker.query", mock_query)
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
 
         score, analysis = await checker.analyze_code_with_claude(
             "=SUM(1,2)", "Sheet1!A1"
@@ -146,6 +734,30 @@ class TestMacroChecker:
         assert score == 8
         assert "test analysis" in analysis.lower()
 
+    @pytest.mark.asyncio
+    async def test_analyze_code_with_claude_multiline_analysis(self, monkeypatch):
+        """Test that out-of-range scores are clamped and analysis keeps all lines."""
+        checker = MacroChecker("dummy.xlsx")
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            yield AssistantMessage(
+                content=[
+                    TextBlock(text="Result:\nSCORE: 12\nANALYSIS: First line.\nSecond.")
+                ],
+                model="claude-test",
+            )
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        score, analysis = await checker.analyze_code_with_claude(
+            "=SUM(1,2)", "Sheet1!A1"
+        )
+
+        assert score == 10
+        assert analysis == "First line.\nSecond."
+
     def test_findings_sorting_by_score(self, temp_xlsx_file):
         """Test that findings are sorted by score in the report."""
         checker = MacroChecker(temp_xlsx_file)
@@ -165,3 +777,359 @@ class TestMacroChecker:
         a3_pos = report.find("A3")  # score 10
 
         assert a2_pos < a1_pos < a3_pos
+
+    @pytest.mark.asyncio
+    async def test_analyze_codes_batch_parses_json_results(self, monkeypatch):
+        """Test that a batched Claude response is split back into per-item results."""
+        checker = MacroChecker("dummy.xlsx")
+        prompts = []
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            prompts.append(kwargs["prompt"])
+            yield AssistantMessage(
+                content=[
+                    TextBlock(
+                        text='```json\n[{"id": 1, "score": 10, "analysis": "Simple sum"},'
+                        ' {"id": 2, "score": 3, "analysis": "Executes a program"}]\n```'
+                    )
+                ],
+                model="claude-test",
+            )
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        results = await checker.analyze_codes_batch(
+            [("=SUM(1,2)", "Sheet1!A1"), ('=EXEC("calc.exe")', "Sheet1!A2")]
+        )
+
+        assert len(prompts) == 1
+        assert results == [(10, "Simple sum"), (3, "Executes a program")]
+
+    @pytest.mark.asyncio
+    async def test_analyze_codes_batch_falls_back_for_missing_items(self, monkeypatch):
+        """Test that items missing from a batched response are analyzed singly."""
+        checker = MacroChecker("dummy.xlsx")
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            if "JSON array" in kwargs["prompt"]:
+                text = '[{"id": 1, "score": 9, "analysis": "Looks fine"}, {"id": 2}]'
+            else:
+                text = "SCORE: 4\nANALYSIS: Analyzed on its own"
+            yield AssistantMessage(content=[TextBlock(text=text)], model="claude-test")
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        results = await checker.analyze_codes_batch(
+            [("=SUM(1,2)", "Sheet1!A1"), ('=INDIRECT("A1")', "Sheet1!A2")]
+        )
+
+        assert results == [(9, "Looks fine"), (4, "Analyzed on its own")]
+
+    @pytest.mark.asyncio
+    async def test_analyze_batches_keeps_batch_order(self, monkeypatch):
+        """Test that concurrent batch results come back in submission order."""
+        checker = MacroChecker("dummy.xlsx")
+
+        async def mock_batch_analyze(items):
+            # Later batches finish first
+            await anyio.sleep(0.01 * (3 - len(items)))
+            return [(len(items), code) for code, _location in items]
+
+        monkeypatch.setattr(checker, "analyze_codes_batch", mock_batch_analyze)
+
+        results = await checker._analyze_batches(
+            [[("a", "A1")], [("b", "B1"), ("c", "C1")]]
+        )
+
+        assert results == [[(1, "a")], [(2, "b"), (2, "c")]]
+
+    @pytest.mark.asyncio
+    async def test_scan_file_caches_analyses_on_disk(
+        self, temp_xlsx_file, tmp_path, monkeypatch
+    ):
+        """Test that Claude results are reused between runs, but errors aren't."""
+        cache_dir = tmp_path / "cache"
+        prompts = []
+        reply = "SCORE: 6\nANALYSIS: External link"
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            prompts.append(kwargs["prompt"])
+            if reply is None:
+                raise RuntimeError("Network down")
+            yield AssistantMessage(content=[TextBlock(text=reply)], model="claude-test")
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        for _ in range(2):
+            checker = MacroChecker(temp_xlsx_file, cache_dir=cache_dir)
+            assert await checker.scan_file() is True
+            assert checker.findings[1].analysis == "External link"
+        assert len(prompts) == 1
+
+        # A failed analysis is retried on the next run
+        reply = None
+        (cache_file,) = (cache_dir / "analysis").iterdir()
+        cache_file.unlink()
+        for _ in range(2):
+            checker = MacroChecker(temp_xlsx_file, cache_dir=cache_dir)
+            assert await checker.scan_file() is True
+            assert checker.findings[1].analysis.startswith("Error during analysis")
+        assert len(prompts) == 3
+
+    @pytest.mark.parametrize(
+        "entry",
+        [
+            b'{"score": 6, "analysis": "Old format"}',
+            b'[6, "Link", "extra"]',
+            b'["6", "String score"]',
+            b'[11, "Out of range"]',
+            b'[6, "Trunc',
+        ],
+    )
+    def test_cached_analysis_ignores_bad_entries(self, tmp_path, entry):
+        """Test that malformed analysis cache entries are discarded as misses."""
+        checker = MacroChecker("dummy.xlsx", cache_dir=tmp_path)
+        code = '=HYPERLINK("http://example.com")'
+        cache_path = checker._analysis_cache_path(code)
+        cache_path.parent.mkdir(parents=True)
+        cache_path.write_bytes(entry)
+
+        assert checker._cached_analysis(code) is None
+        assert not cache_path.exists()
+
+        checker._store_analysis(code, (6, "External link"))
+        assert MacroChecker("dummy.xlsx", cache_dir=tmp_path)._cached_analysis(
+            code
+        ) == (6, "External link")
+
+    @pytest.mark.asyncio
+    async def test_scan_file_fails_on_truncated_ods(self, temp_ods_file, tmp_path):
+        """Test that an unreadable content.xml fails the scan instead of raising."""
+        file_path = tmp_path / "truncated.ods"
+        with zipfile.ZipFile(temp_ods_file) as src, zipfile.ZipFile(
+            file_path, "w"
+        ) as dst:
+            for item in src.infolist():
+                data = src.read(item)
+                if item.filename == "content.xml":
+                    data = data[: len(data) // 2]
+                dst.writestr(item, data)
+
+        assert await MacroChecker(file_path).scan_file() is False
+
+    @pytest.mark.asyncio
+    async def test_scan_file_fails_on_truncated_sheet(self, temp_xlsx_file, tmp_path):
+        """Test that a damaged worksheet fails the scan instead of raising."""
+        file_path = tmp_path / "truncated.xlsx"
+        with zipfile.ZipFile(temp_xlsx_file) as src, zipfile.ZipFile(
+            file_path, "w"
+        ) as dst:
+            for item in src.infolist():
+                data = src.read(item)
+                if item.filename == "xl/worksheets/sheet1.xml":
+                    data = data[: len(data) // 2]
+                dst.writestr(item, data)
+
+        assert await MacroChecker(file_path).scan_file() is False
+
+    @pytest.mark.asyncio
+    async def test_scan_file_fails_on_formula_read_error(
+        self, temp_xlsx_file, monkeypatch
+    ):
+        """Test that errors reading formulas fail the scan, not the task group."""
+        checker = MacroChecker(temp_xlsx_file)
+
+        def fail_detect():
+            raise OSError("Disk went away")
+
+        monkeypatch.setattr(checker, "detect_formula_cells", fail_detect)
+
+        assert await checker.scan_file() is False
+
+    @pytest.mark.asyncio
+    async def test_scan_file_prescreens_formulas(self, temp_xlsx_file, monkeypatch):
+        """Test that scanning only sends ambiguous formulas to Claude."""
+        checker = MacroChecker(temp_xlsx_file)
+        prompts = []
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            prompts.append(kwargs["prompt"])
+            yield AssistantMessage(
+                content=[TextBlock(text="SCORE: 6\nANALYSIS: External link")],
+                model="claude-test",
+            )
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        assert await checker.scan_file() is True
+
+        # =SUM(1,2) is scored locally, only the HYPERLINK formula reaches Claude
+        assert len(prompts) == 1
+        assert "HYPERLINK" in prompts[0]
+        assert [f.item_number for f in checker.findings] == [1, 2]
+        assert [f.score for f in checker.findings] == [10, 6]
+        assert checker.findings[1].cell_reference == ("TestSheet", "A", 3)
+
+    @pytest.mark.asyncio
+    async def test_scan_file_analyzes_duplicate_formulas_once(
+        self, tmp_path, monkeypatch
+    ):
+        """Test that copies of the same formula share a single analysis."""
+        file_path = tmp_path / "duplicates.xlsx"
+        wb = Workbook()
+        ws = wb.active
+        for row in range(1, 6):
+            ws[f"A{row}"] = '=HYPERLINK("http://example.com")'
+        ws["A6"] = '=hyperlink("http://example.com") '
+        wb.save(file_path)
+
+        checker = MacroChecker(file_path)
+        prompts = []
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            prompts.append(kwargs["prompt"])
+            yield AssistantMessage(
+                content=[TextBlock(text="SCORE: 6\nANALYSIS: External link")],
+                model="claude-test",
+            )
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        await checker.scan_file()
+
+        assert len(prompts) == 1
+        assert len(checker.findings) == 6
+        assert all(f.score == 6 for f in checker.findings)
+
+    @pytest.mark.asyncio
+    async def test_unscored_analysis_isnt_cached(self, tmp_path, monkeypatch):
+        """Test that a reply without a score isn't stored on disk."""
+        checker = MacroChecker("dummy.xlsx", cache_dir=tmp_path)
+
+        async def mock_query(*args, **kwargs):
+            from claude_agent_sdk import AssistantMessage, TextBlock
+
+            yield AssistantMessage(
+                content=[TextBlock(text="ANALYSIS: Hard to say")], model="claude-test"
+            )
+
+        monkeypatch.setattr("claude_agent_sdk.query", mock_query)
+
+        result = await checker.analyze_code_with_claude("=INDIRECT(A1)", "Sheet1!A1")
+        checker._store_analysis("=INDIRECT(A1)", result)
+
+        assert result == (5, "Unable to analyze, no score was given: Hard to say")
+        assert not (tmp_path / "analysis").exists()
+
+    def test_formula_dedup_key_keeps_string_case(self):
+        """Test that only the formula outside string literals is case-folded."""
+        key = MacroChecker._formula_dedup_key
+
+        assert key('=hyperlink("http://a.com/X") ') == key(
+            '=HYPERLINK("http://a.com/X")'
+        )
+        assert key('=HYPERLINK("http://a.com/X")') != key(
+            '=HYPERLINK("http://a.com/x")'
+        )
+        assert key('=A1&"say ""Hi"""&b2') == '=A1&"say ""Hi"""&B2'
+
+    def test_analysis_cache_keeps_exact_code(self, tmp_path):
+        """Test that code differing only in case doesn't share a cached analysis."""
+        checker = MacroChecker("dummy.xlsx", cache_dir=tmp_path)
+        checker._store_analysis('Shell "C:\\Temp\\run.exe"', (2, "Runs a program"))
+
+        fresh = MacroChecker("dummy.xlsx", cache_dir=tmp_path)
+        assert fresh._cached_analysis('Shell "C:\\Temp\\run.exe"') == (
+            2,
+            "Runs a program",
+        )
+        assert fresh._cached_analysis('Shell "C:\\TEMP\\RUN.EXE"') is None
+
+    def test_analysis_cache_path_is_versioned(self, tmp_path, monkeypatch):
+        """Test that changing the cache version invalidates stored analyses."""
+        checker = MacroChecker("dummy.xlsx", cache_dir=tmp_path)
+        checker._store_analysis("=WEBSERVICE(A1)", (4, "Fetches a URL"))
+
+        monkeypatch.setattr(
+            "spreadsheet_safety_check.checker._ANALYSIS_CACHE_VERSION", 0
+        )
+        assert (
+            MacroChecker("dummy.xlsx", cache_dir=tmp_path)._cached_analysis(
+                "=WEBSERVICE(A1)"
+            )
+            is None
+        )
+
+    def test_parse_batch_response_skips_brackets_in_prose(self):
+        """Test that bracketed prose before the JSON array is skipped."""
+        text = (
+            "No issues [] with item [1], nor with the list [{}] of options.\n"
+            '```json\n[{"id": 1, "score": 9, "analysis": "Fine"},'
+            ' {"id": 2, "score": 2, "analysis": "Runs [calc.exe]"}]\n```'
+        )
+
+        assert _parse_batch_response(text) == {
+            1: (9, "Fine"),
+            2: (2, "Runs [calc.exe]"),
+        }
+        assert _parse_batch_response("Nothing to report []") == {}
+
+    def test_parse_score_response(self):
+        """Test pulling the score and analysis out of partial responses."""
+        assert _parse_score_response("SCORE: 7/10\nANALYSIS: Fine\n") == (7, "Fine")
+        assert _parse_score_response("Intro\nSCORE: 3\n\nNotes\nANALYSIS: Bad") == (
+            3,
+            "Bad",
+        )
+        # SCORE only counts at the start of a line
+        assert _parse_score_response("My SCORE: 4") == (None, None)
+        assert _parse_score_response("ANALYSIS: No score") == (None, "No score")
+
+    def test_local_prescreen_safe_formula(self):
+        """Test that plain calculations are scored as safe without Claude."""
+        assert _local_prescreen("=SUM(B1:B10)")[0] == 10
+        assert _local_prescreen('=IF($D$1>10, "Yes", "No")')[0] == 10
+        assert _local_prescreen("of:=SUM([.B1:.B10])")[0] == 10
+        assert _local_prescreen("=SUM($XFD$1048576, 'Données'!A1)")[0] == 10
+        assert _local_prescreen('=CONCAT("Prüfung", A1)')[0] == 10
+
+    def test_local_prescreen_dangerous_formula(self):
+        """Test that macro calls and DDE links are scored as malicious."""
+        assert _local_prescreen('=EXEC("calc.exe")')[0] == 1
+        assert _local_prescreen('=REGISTER.ID("Auto_Open")')[0] == 1
+        assert _local_prescreen('=cmd|"/c calc.exe"!A1')[0] == 1
+
+    def test_local_prescreen_char_obfuscation(self):
+        """Test that commands spelled out with CHAR() are decoded and flagged."""
+        score, analysis = _local_prescreen("=CHAR(69)&CHAR(88)&CHAR(69)&CHAR(67)")
+
+        assert score == 2
+        assert "'EXEC'" in analysis
+        assert _local_prescreen('="EX"&CHAR(69)&"C"&"(1)"')[0] == 2
+        # Literals that aren't built up with CHAR() are left to Claude
+        assert _local_prescreen('=IF(A1>1,"Call me",CHAR(10))') is None
+
+    def test_local_prescreen_ambiguous_formula(self):
+        """Test that formulas needing judgement are left for Claude."""
+        assert _local_prescreen('=HYPERLINK("http://example.com")') is None
+        assert _local_prescreen('=INDIRECT("A1")') is None
+        assert _local_prescreen("=CHAR(69)&CHAR(88)") is None
+        assert _local_prescreen("=MyName*2") is None
+        assert _local_prescreen("='[Book1.xlsx]Sheet1'!A1") is None
+        # Names that only look like cell references, or use non-ASCII letters
+        assert _local_prescreen("=ÄPFEL") is None
+        assert _local_prescreen("=SUM(Ädata)") is None
+        assert _local_prescreen("=Ä(1)") is None
+        assert _local_prescreen("=ZZZ1") is None
+        assert _local_prescreen("=SUM(XFE5)") is None
+        assert _local_prescreen("=A1048577") is None
@@ -5,6 +5,7 @@ from unittest.mock import patch
 
 import pytest
 
+from spreadsheet_safety_check.checker import DEFAULT_CACHE_DIR, MacroChecker
 from spreadsheet_safety_check.cli import main
 
 
@@ -68,26 +69,15 @@ class TestCLI:
             "spreadsheet_safety_check.checker.MacroChecker.scan_file", mock_scan_file
         )
 
-        # Mock MacroChecker.__init__ to capture the threshold
-        original_init = None
-        captured_threshold = None
-
-        def capture_init(self, input_file, remove_threshold=5):
-            nonlocal captured_threshold
-            captured_threshold = remove_threshold
-            original_init(self, input_file, remove_threshold)
-
-        from spreadsheet_safety_check.checker import MacroChecker
-
-        original_init = MacroChecker.__init__
-        monkeypatch.setattr(MacroChecker, "__init__", capture_init)
-
+        # Wrap MacroChecker.__init__ to capture the threshold
         with patch.object(
+            MacroChecker, "__init__", autospec=True, side_effect=MacroChecker.__init__
+        ) as mock_init, patch.object(
             sys, "argv", ["prog", str(temp_xlsx_file), "--remove-threshold", "7"]
         ):
             await main()
 
-        assert captured_threshold == 7
+        assert mock_init.call_args.args[2] == 7
 
     @pytest.mark.asyncio
     async def test_main_with_output_dir(self, temp_xlsx_file, tmp_path, monkeypatch):
@@ -111,6 +101,31 @@ class TestCLI:
         assert output_dir.exists()
         assert output_dir.is_dir()
 
+    @pytest.mark.asyncio
+    async def test_main_cache_options(self, temp_xlsx_file, tmp_path, monkeypatch):
+        """Test that --cache-dir and --no-cache reach the checker."""
+        cache_dirs = []
+
+        async def mock_scan_file(self):
+            cache_dirs.append(self.cache_dir)
+            return True
+
+        monkeypatch.setattr(
+            "spreadsheet_safety_check.checker.MacroChecker.scan_file", mock_scan_file
+        )
+
+        cache_dir = tmp_path / "cache"
+        with patch.object(
+            sys, "argv", ["prog", str(temp_xlsx_file), "--cache-dir", str(cache_dir)]
+        ):
+            await main()
+        with patch.object(sys, "argv", ["prog", str(temp_xlsx_file), "--no-cache"]):
+            await main()
+        with patch.object(sys, "argv", ["prog", str(temp_xlsx_file)]):
+            await main()
+
+        assert cache_dirs == [cache_dir, None, DEFAULT_CACHE_DIR]
+
     @pytest.mark.asyncio
     async def test_scan_failure(self, temp_xlsx_file, monkeypatch, capsys):
         """Test CLI behavior when scanning fails."""